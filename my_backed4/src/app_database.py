@@ -3,20 +3,35 @@
 物流管理系統後端 API - 資料庫版 (app_database.py)
 """
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from flask import Flask, request, jsonify, send_file
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict
 from enum import Enum
 import uuid
 import hashlib
+import hmac
+import io
 import jwt
+import xlsxwriter
 from functools import wraps
 import os
 
 app = Flask(__name__)
-CORS(app)
+
+# CORS 政策固定不變，於載入時預先建立標頭，不再每次請求重新計算
+CORS_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Headers', 'Authorization, Content-Type'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+)
+
+@app.after_request
+def _apply_cors_headers(response):
+    for key, value in CORS_HEADERS:
+        response.headers[key] = value
+    return response
 
 # ========== 1. 資料庫設定 ==========
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -24,9 +39,28 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'logistics.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = "my_secret_key_123"
+# 連線池設定：允許跨執行緒共用連線，避免每個請求重新開檔
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'connect_args': {'check_same_thread': False},
+    'pool_size': 10,
+}
 
 db = SQLAlchemy(app)
 
+
+def _set_sqlite_pragmas(dbapi_conn, _connection_record):
+    """每條新連線建立時套用 SQLite PRAGMA (WAL 模式可讀寫並行，NORMAL 減少 fsync)"""
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.close()
+
+
+with app.app_context():
+    event.listen(db.engine, 'connect', _set_sqlite_pragmas)
+
 # ========== 2. Enum 定義 (轉為字串儲存) ==========
 class CustomerType(Enum):
     CONTRACT = "合約"
@@ -110,7 +144,26 @@ class Package(db.Model):
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
+# 帳號不存在時仍做一次雜湊比對，避免以回應時間推測帳號是否存在
+_DUMMY_HASH = hash_password(uuid.uuid4().hex)
+
+# 角色權限等級
+ROLE_LEVELS = {'customer': 0, 'staff': 1, 'admin': 2}
+
+# JWT 只驗證系統有使用的欄位 (payload 使用短鍵: u=username, r=role, l=level)
+JWT_DECODE_OPTIONS = {
+    "verify_signature": True,
+    "verify_exp": True,
+    "verify_nbf": False,
+    "verify_iat": False,
+    "verify_aud": False,
+    "verify_iss": False,
+    "require": ["exp", "u", "r"],
+}
+
 def verify_token_and_role(required_role: str = None):
+    req_level = ROLE_LEVELS.get(required_role, 0) if required_role else 0
+
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
@@ -119,16 +172,14 @@ def verify_token_and_role(required_role: str = None):
                 return jsonify({"error": "缺少 Authorization header"}), 401
             try:
                 token = auth_header.replace("Bearer ", "")
-                payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-                
-                role_levels = {'customer': 0, 'staff': 1, 'admin': 2}
-                user_level = role_levels.get(payload['role'], 0)
-                req_level = role_levels.get(required_role, 0) if required_role else 0
+                payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"],
+                                     options=JWT_DECODE_OPTIONS)
 
+                user_level = payload.get('l', ROLE_LEVELS.get(payload['r'], 0))
                 if user_level < req_level:
                     return jsonify({"error": f"權限不足，需要 {required_role} 權限"}), 403
-                
-                request.current_user = payload
+
+                request.current_user = {"username": payload['u'], "role": payload['r']}
             except jwt.ExpiredSignatureError:
                 return jsonify({"error": "Token 已過期"}), 401
             except Exception:
@@ -161,14 +212,20 @@ def register():
 @app.route('/api/auth/login', methods=['POST'])
 def login():
     data = request.json
+    password_hash = hash_password(data['password'])
+
+    # 每次都以資料庫為準 (帳號可能由其他 worker 或外部程式新增)
     user = User.query.filter_by(username=data['username']).first()
-    
-    if not user or user.password_hash != hash_password(data['password']):
+    if not user:
+        hmac.compare_digest(password_hash, _DUMMY_HASH)
+        return jsonify({"error": "帳號或密碼錯誤"}), 401
+    if not hmac.compare_digest(user.password_hash, password_hash):
         return jsonify({"error": "帳號或密碼錯誤"}), 401
     
     token = jwt.encode({
-        "username": user.username,
-        "role": user.role,
+        "u": user.username,
+        "r": user.role,
+        "l": ROLE_LEVELS.get(user.role, 0),
         "exp": datetime.utcnow() + timedelta(hours=3)
     }, app.config['SECRET_KEY'], algorithm="HS256")
     
@@ -248,6 +305,54 @@ def search_parcels():
     results = query.all()
     return jsonify([p.to_dict() for p in results])
 
+# ========== 匯出 Excel ==========
+PACKAGE_HEADERS = ["追蹤編號", "寄件人", "收件人", "收件地址", "重量", "距離",
+                   "狀態", "服務類型", "位置", "建立時間"]
+
+def _write_row(ws, row: int, values: list) -> None:
+    """write_row 失敗時會略過該列剩下的欄位，回傳非 0 就直接報錯"""
+    rc = ws.write_row(row, 0, values)
+    if rc != 0:
+        raise ValueError(f"{ws.name} 第 {row + 1} 列無法寫入 (xlsxwriter 回傳 {rc})")
+
+def export_packages_xlsx(output) -> None:
+    """
+    以 xlsxwriter constant_memory 模式逐列寫出包裹資料到 output (路徑或 BytesIO)，記憶體用量不隨筆數成長
+    字串照原樣輸出，不自動轉成網址 / 公式 / 數字
+    """
+    wb = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'strings_to_urls': False,
+        'strings_to_formulas': False,
+        'strings_to_numbers': False,
+    })
+    try:
+        ws = wb.add_worksheet('Parcels')
+        _write_row(ws, 0, PACKAGE_HEADERS)
+        rows = Package.query.order_by(Package.created_at).yield_per(1000)
+        for i, p in enumerate(rows, start=1):
+            _write_row(ws, i, [
+                p.tracking_number, p.sender_id, p.recipient_name, p.recipient_address,
+                p.weight, p.distance, p.status, p.service_type, p.location,
+                p.created_at.strftime("%Y-%m-%d %H:%M:%S")
+            ])
+    finally:
+        wb.close()
+
+@app.route('/api/export', methods=['GET'])
+@verify_token_and_role('admin')
+def export_parcels():
+    # 每個請求各寫一份到記憶體，同時匯出不會互相覆蓋，也不會送出寫到一半的檔案
+    output = io.BytesIO()
+    export_packages_xlsx(output)
+    output.seek(0)
+    return send_file(
+        output,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name='logistics.xlsx',
+    )
+
 # ========== 6. 初始化 ==========
 def init_db():
     with app.app_context():
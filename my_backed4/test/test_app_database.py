@@ -146,4 +146,65 @@ def test_search_parcel_permission(client):
     results = response.json
     # 應該只找得到自己 (customer1) 的那一個
     assert len(results) == 1
-    assert results[0]['sender_id'] == 'customer1'
\ No newline at end of file
+    assert results[0]['sender_id'] == 'customer1'
+
+def test_login_unknown_user(client):
+    """測試不存在的帳號登入 (應該回傳 401)"""
+    response = client.post('/api/auth/login',
+                          data=json.dumps({'username': 'nobody', 'password': 'x'}),
+                          content_type='application/json')
+
+    assert response.status_code == 401
+    assert '帳號或密碼錯誤' in response.json['error']
+
+def test_login_user_inserted_directly(client):
+    """測試直接寫入資料庫的帳號 (不經過本程式) 也能登入"""
+    from sqlalchemy import text
+    get_token(client, 'admin', 'admin123')  # 先登入過一次，確認不會沿用舊的帳號清單
+
+    with app.app_context():
+        db.session.execute(
+            text("INSERT INTO user (username, password_hash, role) VALUES (:u, :p, 'staff')"),
+            {'u': 'staff2', 'p': hash_password('staff456')},
+        )
+        db.session.commit()
+
+    response = client.post('/api/auth/login',
+                          data=json.dumps({'username': 'staff2', 'password': 'staff456'}),
+                          content_type='application/json')
+    assert response.status_code == 200
+    assert response.json['role'] == 'staff'
+
+def test_export_parcels_xlsx(client):
+    """測試管理員匯出包裹 Excel"""
+    admin_token = get_token(client, 'admin', 'admin123')
+    client.post('/api/parcels',
+               data=json.dumps({'sender_id': 'customer1', 'recipient_name': 'R1', 'recipient_address': 'A1'}),
+               headers={'Authorization': f'Bearer {admin_token}'}, content_type='application/json')
+
+    response = client.get('/api/export', headers={'Authorization': f'Bearer {admin_token}'})
+    assert response.status_code == 200
+    assert response.data[:2] == b'PK'  # xlsx 為 zip 格式
+
+    staff_token = get_token(client, 'staff1', 'staff123')
+    response = client.get('/api/export', headers={'Authorization': f'Bearer {staff_token}'})
+    assert response.status_code == 403
+
+def test_export_keeps_text_as_is(client):
+    """測試像公式或超長網址的文字原樣匯出，不被轉換或截掉"""
+    import io
+    import openpyxl
+    long_url = 'https://example.com/' + 'a' * 2100
+
+    admin_token = get_token(client, 'admin', 'admin123')
+    client.post('/api/parcels',
+               data=json.dumps({'sender_id': 'customer1', 'recipient_name': '=1+1', 'recipient_address': long_url}),
+               headers={'Authorization': f'Bearer {admin_token}'}, content_type='application/json')
+
+    response = client.get('/api/export', headers={'Authorization': f'Bearer {admin_token}'})
+    assert response.status_code == 200
+    wb = openpyxl.load_workbook(io.BytesIO(response.data), read_only=True)
+    row = next(r for r in wb['Parcels'].iter_rows(min_row=2, values_only=True) if r[3] == long_url)
+    assert row[2] == '=1+1'
+    assert row[9]  # 建立時間沒有因為前面的欄位失敗而被略過
+    wb.close()
@@ -1,13 +1,24 @@
 from flask import Flask, request, jsonify, send_file
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 import jwt
+import orjson
 from functools import wraps
 from datetime import datetime, timedelta
+from collections import OrderedDict
+import threading
+import hashlib
+import hmac
+import secrets
+import time
 import os
+import sqlite3
 
-from excel_db import (
-    EXCEL_FILE,
-    initialize_excel,
+import excel_db
+from excel_db import EXCEL_FILE, export_excel
+from db import (
+    initialize_db,
+    data_version,
     append_customer,
     read_customers,
     update_customer,
@@ -16,12 +27,69 @@ from excel_db import (
     update_parcel_amount,
 )
 
+# ------------------------------------------------
+# JSON 改用 orjson：比標準庫快，中文直接輸出 UTF-8 不轉成 \uXXXX
+# ------------------------------------------------
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 SECRET_KEY = "my_secret_key_for_jwt_12345"
 
 
+# ------------------------------------------------
+# 固定的錯誤回應：內容先序列化好，每次只包成 Response 回傳
+# ------------------------------------------------
+ERR_MISSING_TOKEN = orjson.dumps({"error": "缺少 JWT Token"})
+ERR_TOKEN_EXPIRED = orjson.dumps({"error": "Token 已過期"})
+ERR_INVALID_TOKEN = orjson.dumps({"error": "無效 Token"})
+ERR_FORBIDDEN = orjson.dumps({"error": "權限不足"})
+ERR_ADMIN_ONLY = orjson.dumps({"error": "只有管理員可以修改客戶資料"})
+
+
+def error_response(body, status):
+    return app.response_class(body, status=status, mimetype="application/json")
+
+
+# ------------------------------------------------
+# 已驗證 Token 快取（key = token 字串，到 exp 為止有效）
+# ------------------------------------------------
+_JWT_CACHE = OrderedDict()
+_JWT_CACHE_MAX = 10_000
+_JWT_CACHE_LOCK = threading.Lock()
+
+
+def get_cached_token(token):
+    with _JWT_CACHE_LOCK:
+        data = _JWT_CACHE.get(token)
+        if data is None:
+            return None
+
+        if data["exp"] <= time.time():
+            del _JWT_CACHE[token]
+            return None
+
+        _JWT_CACHE.move_to_end(token)
+        return data
+
+
+def cache_token(token, data):
+    # 只快取驗證成功的 Token；超過上限時淘汰最久沒用到的
+    with _JWT_CACHE_LOCK:
+        _JWT_CACHE[token] = data
+        _JWT_CACHE.move_to_end(token)
+        if len(_JWT_CACHE) > _JWT_CACHE_MAX:
+            _JWT_CACHE.popitem(last=False)
+
+
 # ------------------------------------------------
 # JWT 驗證裝飾器
 # ------------------------------------------------
@@ -36,15 +104,27 @@ def token_required(f):
                 token = auth.split(" ")[1]
 
         if not token:
-            return jsonify({"error": "缺少 JWT Token"}), 401
+            return error_response(ERR_MISSING_TOKEN, 401)
+
+        cached = get_cached_token(token)
+        if cached is not None:
+            request.user = cached
+            return f(*args, **kwargs)
 
         try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            request.user = data
+            data = jwt.decode(
+                token,
+                SECRET_KEY,
+                algorithms=["HS256"],
+                options={"require": ["exp", "username", "role"], "verify_exp": True},
+            )
         except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token 已過期"}), 401
-        except Exception:
-            return jsonify({"error": "無效 Token"}), 401
+            return error_response(ERR_TOKEN_EXPIRED, 401)
+        except jwt.InvalidTokenError:
+            return error_response(ERR_INVALID_TOKEN, 401)
+
+        cache_token(token, data)
+        request.user = data
 
         return f(*args, **kwargs)
 
@@ -54,9 +134,14 @@ def token_required(f):
 # ------------------------------------------------
 # 模擬帳號資料
 # ------------------------------------------------
+def hash_password(password):
+    return hashlib.sha256(password.encode()).digest()
+
+
+# 只保存密碼雜湊，登入時以固定時間比對
 ACCOUNTS = {
-    "staff1": {"password": "staff123", "role": "staff"},
-    "admin1": {"password": "admin123", "role": "admin"},
+    "staff1": {"pwhash": hash_password("staff123"), "role": "staff"},
+    "admin1": {"pwhash": hash_password("admin123"), "role": "admin"},
 }
 # 客戶會透過 /api/auth/register 加進來（存在記憶體）
 
@@ -76,7 +161,7 @@ def login():
     if username not in ACCOUNTS:
         return jsonify({"error": "帳號不存在"}), 401
 
-    if ACCOUNTS[username]["password"] != password:
+    if not hmac.compare_digest(hash_password(password), ACCOUNTS[username]["pwhash"]):
         return jsonify({"error": "密碼錯誤"}), 401
 
     token = jwt.encode(
@@ -120,7 +205,7 @@ def register_customer_account():
         return jsonify({"error": "帳號已存在"}), 400
 
     ACCOUNTS[username] = {
-        "password": password,
+        "pwhash": hash_password(password),
         "role": "customer",
         "name": name,
         "phone": phone,
@@ -149,7 +234,7 @@ def register_customer_account():
 @token_required
 def create_customer():
     if request.user.get("role") not in ["staff", "admin"]:
-        return jsonify({"error": "權限不足"}), 403
+        return error_response(ERR_FORBIDDEN, 403)
 
     data = request.get_json() or {}
     append_customer(data)
@@ -165,7 +250,7 @@ def create_customer():
 def list_customers():
     role = request.user.get("role")
     if role not in ["staff", "admin"]:
-        return jsonify({"error": "權限不足"}), 403
+        return error_response(ERR_FORBIDDEN, 403)
 
     customers = read_customers() or []
     return jsonify(customers)
@@ -176,7 +261,7 @@ def list_customers():
 @token_required
 def edit_customer(account):
     if request.user.get("role") != "admin":
-        return jsonify({"error": "只有管理員可以修改客戶資料"}), 403
+        return error_response(ERR_ADMIN_ONLY, 403)
 
     data = request.get_json() or {}
     update_customer(account, data)
@@ -187,6 +272,21 @@ def edit_customer(account):
 # ------------------------------------------------
 # 建立包裹
 # ------------------------------------------------
+# 日期字串一天只需要格式化一次：(日序號, "YYYYMMDD")
+_DATE_PREFIX = (0, "")
+
+# 追蹤編號撞號時最多重新產生幾次
+TRACKING_NUMBER_RETRIES = 5
+
+
+def today_prefix(now):
+    global _DATE_PREFIX
+    day = now.toordinal()
+    if _DATE_PREFIX[0] != day:
+        _DATE_PREFIX = (day, now.strftime("%Y%m%d"))
+    return _DATE_PREFIX[1]
+
+
 @app.route("/api/parcels", methods=["POST"])
 @token_required
 def create_parcel():
@@ -214,24 +314,31 @@ def create_parcel():
     if not sender_id or not recipient_name:
         return jsonify({"error": "缺少寄件人或收件人"}), 400
 
-    today = datetime.now().strftime("%Y%m%d")
-    rand4 = str(datetime.now().microsecond)[-4:]
-    tracking_number = f"TRK-{today}-{rand4}"
-    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    record = {
-        "tracking_number": tracking_number,
-        "sender_id": sender_id,
-        "recipient_name": recipient_name,
-        "recipient_address": recipient_address,
-        "weight": weight,
-        "service_type": service_type,
-        "status": "建立包裹",
-        "amount": None,
-        "created_at": created_at,
-    }
-
-    append_parcel(record)
+    # 隨機碼用 secrets（6 碼十六進位），不會因同一微秒建立而撞號；
+    # 萬一跟既有的追蹤編號重複（主鍵衝突）就換一個重試
+    now = datetime.now()
+    created_at = now.isoformat(sep=" ", timespec="seconds")
+
+    for _ in range(TRACKING_NUMBER_RETRIES):
+        tracking_number = f"TRK-{today_prefix(now)}-{secrets.token_hex(3)}"
+        record = {
+            "tracking_number": tracking_number,
+            "sender_id": sender_id,
+            "recipient_name": recipient_name,
+            "recipient_address": recipient_address,
+            "weight": weight,
+            "service_type": service_type,
+            "status": "建立包裹",
+            "amount": None,
+            "created_at": created_at,
+        }
+        try:
+            append_parcel(record)
+            break
+        except sqlite3.IntegrityError:
+            continue
+    else:
+        return jsonify({"error": "無法產生追蹤編號，請稍後再試"}), 503
 
     return jsonify(
         {
@@ -276,8 +383,33 @@ def set_parcel_amount():
 # ------------------------------------------------
 # 進階查詢（search.html 用）
 # ------------------------------------------------
+# /records 的回應內容只在資料寫入後改變 → 以資料版本算 ETag，並快取序列化結果
+_RECORDS_CACHE = {"etag": None, "body": None}
+
+
+def data_etag():
+    return hashlib.blake2b(data_version().encode(), digest_size=8).hexdigest()
+
+
 @app.route("/records", methods=["GET"])
+@token_required
 def list_records():
+    etag = data_etag()
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    if _RECORDS_CACHE["etag"] != etag:
+        _RECORDS_CACHE["body"] = jsonify(build_records()).get_data()
+        _RECORDS_CACHE["etag"] = etag
+
+    resp = app.response_class(_RECORDS_CACHE["body"], mimetype="application/json")
+    resp.set_etag(etag)
+    return resp
+
+
+def build_records():
     parcels = read_parcels() or []
 
     rows = []
@@ -297,25 +429,35 @@ def list_records():
             }
         )
 
-    return jsonify(rows)
+    return rows
 
 
 # ------------------------------------------------
 # Excel 下載
 # ------------------------------------------------
+# 上次匯出時的資料版本；匯出與狀態更新都在 lock 內，一次只有一個人重建檔案
+_EXPORT_STATE = {"etag": None}
+_EXPORT_LOCK = threading.Lock()
+
+
 @app.route("/api/download", methods=["GET"])
+@token_required
 def download_excel():
-    initialize_excel()
-    if not os.path.exists(EXCEL_FILE):
-        return jsonify({"error": "找不到 Excel 檔案"}), 500
+    # 資料有變動才重新匯出；conditional：If-None-Match 相符時直接回 304
+    with _EXPORT_LOCK:
+        # 讀資料前先取版本：讀取途中若有寫入，記下的是舊版本，下次下載會再重建
+        etag = data_etag()
+        if _EXPORT_STATE["etag"] != etag or not os.path.exists(EXCEL_FILE):
+            export_excel(read_customers(), read_parcels())
+            _EXPORT_STATE["etag"] = etag
 
-    return send_file(EXCEL_FILE, as_attachment=True)
+    return send_file(EXCEL_FILE, as_attachment=True, etag=etag, conditional=True)
 
 
 # ------------------------------------------------
-# 啟動前先初始化 Excel
+# 啟動前先初始化資料庫（第一次啟動會搬移舊的 Excel 資料）
 # ------------------------------------------------
-initialize_excel()
+initialize_db(excel_db.read_customers, excel_db.read_parcels)
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,170 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+DB_FILE = "logistics.db"
+
+CUSTOMER_FIELDS = ["account", "name", "phone", "email", "address", "created_at"]
+
+PARCEL_FIELDS = [
+    "tracking_number",
+    "sender_id",
+    "recipient_name",
+    "recipient_address",
+    "weight",
+    "service_type",
+    "status",
+    "amount",
+    "created_at",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    account    TEXT,
+    name       TEXT,
+    phone      TEXT,
+    email      TEXT,
+    address    TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_customers_account ON customers(account);
+
+CREATE TABLE IF NOT EXISTS parcels (
+    tracking_number   TEXT PRIMARY KEY,
+    sender_id         TEXT,
+    recipient_name    TEXT,
+    recipient_address TEXT,
+    weight,
+    service_type      TEXT,
+    status            TEXT,
+    amount            REAL,
+    created_at        TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_parcels_sender ON parcels(sender_id);
+"""
+
+# 單一連線（autocommit），所有存取以 lock 序列化
+_conn = None
+_lock = threading.Lock()
+
+# 資料版本：每次寫入 +1，搭配啟動時間給 ETag 使用
+_STARTED_AT = time.time()
+_version = 0
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_FILE, isolation_level=None, check_same_thread=False)
+        _conn.row_factory = sqlite3.Row
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+    return _conn
+
+
+def _write(sql, params=()):
+    global _version
+    with _lock:
+        cur = _connect().execute(sql, params)
+        _version += 1
+        return cur.rowcount
+
+
+def _read(sql, params=()):
+    with _lock:
+        return [dict(r) for r in _connect().execute(sql, params)]
+
+
+def data_version():
+    return f"{_STARTED_AT}:{_version}"
+
+
+# ------------------------------------------------
+# 初始化：建立資料表；舊資料在 Excel 時一次搬進來
+# ------------------------------------------------
+def initialize_db(legacy_customers=None, legacy_parcels=None):
+    """legacy_* 為讀取舊 Excel 的函式，只有資料庫是空的時候才會呼叫"""
+    with _lock:
+        conn = _connect()
+        conn.executescript(SCHEMA)
+
+        empty = (
+            conn.execute("SELECT 1 FROM customers LIMIT 1").fetchone() is None
+            and conn.execute("SELECT 1 FROM parcels LIMIT 1").fetchone() is None
+        )
+        if not empty:
+            return
+
+        customers = legacy_customers() if legacy_customers else []
+        parcels = legacy_parcels() if legacy_parcels else []
+
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO customers VALUES (?, ?, ?, ?, ?, ?)",
+            ([c.get(f) for f in CUSTOMER_FIELDS] for c in customers),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO parcels VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ([p.get(f) for f in PARCEL_FIELDS] for p in parcels),
+        )
+        conn.execute("COMMIT")
+
+
+# ------------------------------------------------
+# Customers：新增 / 讀取 / 更新
+# ------------------------------------------------
+def append_customer(data):
+    _write(
+        "INSERT INTO customers VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            data.get("account"),
+            data.get("name"),
+            data.get("phone"),
+            data.get("email"),
+            data.get("address"),
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        ),
+    )
+
+
+def read_customers():
+    return _read("SELECT * FROM customers ORDER BY rowid")
+
+
+def update_customer(account, data):
+    """
+    以帳號為 key 更新姓名 / 電話 / Email / 地址，不動建立時間
+    data 可有 name, phone, email, address
+    """
+    fields = [f for f in ("name", "phone", "email", "address") if f in data]
+    if not fields:
+        return
+
+    sets = ", ".join(f"{f} = ?" for f in fields)
+    _write(
+        f"UPDATE customers SET {sets} "
+        "WHERE rowid = (SELECT min(rowid) FROM customers WHERE account = ?)",
+        [data[f] for f in fields] + [str(account)],
+    )
+
+
+# ------------------------------------------------
+# Parcels：新增 / 讀取 / 更新金額
+# ------------------------------------------------
+def append_parcel(data):
+    _write(
+        "INSERT INTO parcels VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [data.get(f) for f in PARCEL_FIELDS],
+    )
+
+
+def read_parcels():
+    return _read("SELECT * FROM parcels ORDER BY rowid")
+
+
+def update_parcel_amount(tracking_number, amount):
+    _write(
+        "UPDATE parcels SET amount = ? WHERE tracking_number = ?",
+        (amount, str(tracking_number)),
+    )
@@ -29,8 +29,14 @@ CUSTOMER_HEADERS = [
 # ------------------------------------------------
 EXCEL_FILE = "logistics.xlsx"
 
+# 結構檢查只需要做一次；檔案之後被刪掉或壞掉時會清掉重新檢查
+_INITIALIZED = False
+
 def initialize_excel():
     """檢查 Excel 檔，如果不存在就建立；如果壞掉就重建。"""
+    global _INITIALIZED
+    if _INITIALIZED and os.path.exists(EXCEL_FILE):
+        return
 
     def create_new_excel():
         from openpyxl import Workbook
@@ -62,17 +68,44 @@ def initialize_excel():
     # 檔案不存在 → 直接建立新的
     if not os.path.exists(EXCEL_FILE):
         create_new_excel()
+        _INITIALIZED = True
         return
 
     # 檔案存在 → 檢查是不是合法的 xlsx
     try:
         wb = openpyxl.load_workbook(EXCEL_FILE)
-        wb.close()
     except BadZipFile:
         # 檔案壞掉 → 先備份改名，再重建一份新的
         backup_name = f"broken_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{EXCEL_FILE}"
         os.rename(EXCEL_FILE, backup_name)
         create_new_excel()
+        _INITIALIZED = True
+        return
+
+    # Parcels 標題列不對時修正（只在這裡檢查，更新金額時不再重寫標題）
+    if "Parcels" in wb.sheetnames:
+        ws = wb["Parcels"]
+        changed = False
+        for i, header in enumerate(PARCEL_HEADERS, start=1):
+            if ws.cell(row=1, column=i).value != header:
+                ws.cell(row=1, column=i, value=header)
+                changed = True
+        if changed:
+            wb.save(EXCEL_FILE)
+
+    wb.close()
+    _INITIALIZED = True
+
+
+def _load_workbook(**kwargs):
+    """開啟活頁簿；檔案在啟動後才壞掉時，清掉初始化旗標重新檢查 (備份後重建) 再開一次"""
+    global _INITIALIZED
+    try:
+        return openpyxl.load_workbook(EXCEL_FILE, **kwargs)
+    except (BadZipFile, FileNotFoundError):
+        _INITIALIZED = False
+        initialize_excel()
+        return openpyxl.load_workbook(EXCEL_FILE, **kwargs)
 
 
 
@@ -81,7 +114,7 @@ def initialize_excel():
 # ------------------------------------------------
 def append_customer(data):
     initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
+    wb = _load_workbook()
     ws = wb["Customers"]
 
     ws.append([
@@ -98,27 +131,31 @@ def append_customer(data):
 
 def read_customers():
     initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-
-    if "Customers" not in wb.sheetnames:
-        return []
-
-    ws = wb["Customers"]
-    customers = []
-
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        if not any(row):
-            continue
-        customers.append({
-            "account": row[0],
-            "name": row[1],
-            "phone": row[2],
-            "email": row[3],
-            "address": row[4],
-            "created_at": row[5],
-        })
+    # 只讀模式：不建立完整的儲存格物件，讀大檔案快很多
+    wb = _load_workbook(read_only=True, data_only=True)
 
-    return customers
+    try:
+        if "Customers" not in wb.sheetnames:
+            return []
+
+        ws = wb["Customers"]
+        customers = []
+
+        for row in ws.iter_rows(min_row=2, values_only=True):
+            if row[0] is None:  # 主鍵欄為空 → 空白列
+                continue
+            customers.append({
+                "account": row[0],
+                "name": row[1],
+                "phone": row[2],
+                "email": row[3],
+                "address": row[4],
+                "created_at": row[5],
+            })
+
+        return customers
+    finally:
+        wb.close()
 
 
 def update_customer(account, data):
@@ -127,7 +164,7 @@ def update_customer(account, data):
     data 可有 name, phone, email, address
     """
     initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
+    wb = _load_workbook()
 
     if "Customers" not in wb.sheetnames:
         return
@@ -154,7 +191,7 @@ def update_customer(account, data):
 # ------------------------------------------------
 def append_parcel(data):
     initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
+    wb = _load_workbook()
 
     if "Parcels" not in wb.sheetnames:
         ws = wb.create_sheet("Parcels")
@@ -179,45 +216,45 @@ def append_parcel(data):
 
 def read_parcels():
     initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
+    wb = _load_workbook(read_only=True, data_only=True)
 
-    if "Parcels" not in wb.sheetnames:
-        return []
-
-    ws = wb["Parcels"]
-    parcels = []
-
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        if not any(row):
-            continue
-
-        parcels.append({
-            "tracking_number": row[0],
-            "sender_id": row[1],
-            "recipient_name": row[2],
-            "recipient_address": row[3],
-            "weight": row[4],
-            "service_type": row[5],
-            "status": row[6],
-            "amount": row[7],
-            "created_at": row[8],
-        })
+    try:
+        if "Parcels" not in wb.sheetnames:
+            return []
 
-    return parcels
+        ws = wb["Parcels"]
+        parcels = []
+
+        for row in ws.iter_rows(min_row=2, values_only=True):
+            if row[0] is None:  # 主鍵欄為空 → 空白列
+                continue
+
+            parcels.append({
+                "tracking_number": row[0],
+                "sender_id": row[1],
+                "recipient_name": row[2],
+                "recipient_address": row[3],
+                "weight": row[4],
+                "service_type": row[5],
+                "status": row[6],
+                "amount": row[7],
+                "created_at": row[8],
+            })
+
+        return parcels
+    finally:
+        wb.close()
 
 
 def update_parcel_amount(tracking_number, amount):
     initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
+    wb = _load_workbook()
 
     if "Parcels" not in wb.sheetnames:
         return
 
     ws = wb["Parcels"]
 
-    for i, header in enumerate(PARCEL_HEADERS, start=1):
-        ws.cell(row=1, column=i, value=header)
-
     for row in ws.iter_rows(min_row=2):
         if str(row[0].value) == str(tracking_number):
             row[7].value = amount   # 金額欄
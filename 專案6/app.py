@@ -6,7 +6,6 @@ from datetime import datetime, timedelta
 import os
 
 from excel_db import (
-    EXCEL_FILE,
     initialize_excel,
     append_customer,
     read_customers,
@@ -15,6 +14,7 @@ from excel_db import (
     read_parcels,
     update_parcel_amount,
     update_parcel_status,
+    export_excel,
 )
 
 app = Flask(__name__)
@@ -341,11 +341,11 @@ def download_excel():
     if role == "customer":
         return jsonify({"error": "權限不足：客戶不可下載 Excel"}), 403
 
-    initialize_excel()
-    if not os.path.exists(EXCEL_FILE):
+    path = export_excel()
+    if not os.path.exists(path):
         return jsonify({"error": "找不到 Excel 檔案"}), 500
 
-    return send_file(EXCEL_FILE, as_attachment=True)
+    return send_file(path, as_attachment=True)
 
 
 # ------------------------------------------------
@@ -1,9 +1,21 @@
 import os
+import threading
 from datetime import datetime
 import openpyxl
-from openpyxl import Workbook
+import xlsxwriter
 from zipfile import BadZipFile
 
+from storage import (
+    CUSTOMERS_JOURNAL,
+    PARCELS_JOURNAL,
+    append_record,
+    append_records,
+    append_update,
+    fold_records,
+    has_key,
+    repair_journal,
+)
+
 EXCEL_FILE = "logistics.xlsx"
 
 CUSTOMER_HEADERS = [
@@ -27,200 +39,154 @@ PARCEL_HEADERS = [
     "建立時間",
 ]
 
+CUSTOMER_FIELDS = ["account", "name", "phone", "email", "address", "created_at"]
+
+PARCEL_FIELDS = [
+    "tracking_number",
+    "sender_id",
+    "recipient_name",
+    "recipient_address",
+    "weight",
+    "service_type",
+    "status",
+    "amount",
+    "created_at",
+]
+
+# 紀錄檔是同步寫入的正本，Excel 只在下載時依紀錄檔產生
+_EXPORT_LOCK = threading.Lock()
+
 
 # --------------------------------------------------
-# 初始化 Excel
+# 初始化
+# 資料改存在 JSONL 紀錄檔（storage.py），Excel 只在下載時產生
 # --------------------------------------------------
 def initialize_excel():
+    # 上次當機時寫到一半的最後一行先處理掉
+    repair_journal(CUSTOMERS_JOURNAL)
+    repair_journal(PARCELS_JOURNAL)
 
-    def create_new():
-        wb = Workbook()
-        ws1 = wb.active
-        ws1.title = "Customers"
-        ws1.append(CUSTOMER_HEADERS)
-
-        ws2 = wb.create_sheet("Parcels")
-        ws2.append(PARCEL_HEADERS)
-
-        wb.save(EXCEL_FILE)
-
-    if not os.path.exists(EXCEL_FILE):
-        create_new()
-        return
-
-    try:
-        wb = openpyxl.load_workbook(EXCEL_FILE)
-    except BadZipFile:
-        backup = f"broken_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{EXCEL_FILE}"
-        os.rename(EXCEL_FILE, backup)
-        create_new()
+    if os.path.exists(CUSTOMERS_JOURNAL) and os.path.exists(PARCELS_JOURNAL):
         return
 
-    changed = False
-
-    # Customers
-    if "Customers" not in wb.sheetnames:
-        ws = wb.create_sheet("Customers", 0)
-        ws.append(CUSTOMER_HEADERS)
-        changed = True
-    else:
-        ws = wb["Customers"]
-        for i, h in enumerate(CUSTOMER_HEADERS, start=1):
-            if ws.cell(row=1, column=i).value != h:
-                ws.cell(row=1, column=i, value=h)
-                changed = True
-
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        for r in range(2, ws.max_row + 1):
-            if ws.cell(row=r, column=6).value in (None, ""):
-                ws.cell(row=r, column=6, value=now)
-                changed = True
-
-    # Parcels
-    if "Parcels" not in wb.sheetnames:
-        ws2 = wb.create_sheet("Parcels")
-        ws2.append(PARCEL_HEADERS)
-        changed = True
-
-    if changed:
-        wb.save(EXCEL_FILE)
+    customers = []
+    parcels = []
 
-    wb.close()
+    # 舊版資料在 Excel 裡 → 第一次啟動時搬到紀錄檔
+    if os.path.exists(EXCEL_FILE):
+        try:
+            wb = openpyxl.load_workbook(EXCEL_FILE, read_only=True, data_only=True)
+        except BadZipFile:
+            backup = f"broken_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{EXCEL_FILE}"
+            os.rename(EXCEL_FILE, backup)
+        else:
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if "Customers" in wb.sheetnames:
+                for r in wb["Customers"].iter_rows(min_row=2, values_only=True):
+                    c = dict(zip(CUSTOMER_FIELDS, r))
+                    if c.get("created_at") in (None, ""):
+                        c["created_at"] = now
+                    customers.append(c)
+            if "Parcels" in wb.sheetnames:
+                for r in wb["Parcels"].iter_rows(min_row=2, values_only=True):
+                    parcels.append(dict(zip(PARCEL_FIELDS, r)))
+            wb.close()
+
+    if not os.path.exists(CUSTOMERS_JOURNAL):
+        append_records(CUSTOMERS_JOURNAL, customers)
+    if not os.path.exists(PARCELS_JOURNAL):
+        append_records(PARCELS_JOURNAL, parcels)
 
 
 # --------------------------------------------------
 # Customers
 # --------------------------------------------------
 def append_customer(data):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Customers"]
-
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    ws.append([
-        data.get("account", ""),
-        data.get("name", ""),
-        data.get("phone", ""),
-        data.get("email", ""),
-        data.get("address", ""),
-        now,
-    ])
-
-    wb.save(EXCEL_FILE)
-    wb.close()
+    append_record(CUSTOMERS_JOURNAL, {
+        "account": data.get("account", ""),
+        "name": data.get("name", ""),
+        "phone": data.get("phone", ""),
+        "email": data.get("email", ""),
+        "address": data.get("address", ""),
+        "created_at": now,
+    })
 
 
 def read_customers():
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Customers"]
-
-    result = []
-    for r in ws.iter_rows(min_row=2, values_only=True):
-        result.append({
-            "account": r[0],
-            "name": r[1],
-            "phone": r[2],
-            "email": r[3],
-            "address": r[4],
-            "created_at": r[5],
-        })
-
-    wb.close()
-    return result
+    return fold_records(CUSTOMERS_JOURNAL, "account")
 
 
 def update_customer(account, data):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Customers"]
-
-    for row in ws.iter_rows(min_row=2):
-        if row[0].value == account:
-            row[1].value = data.get("name", row[1].value)
-            row[2].value = data.get("phone", row[2].value)
-            row[3].value = data.get("email", row[3].value)
-            row[4].value = data.get("address", row[4].value)
-            break
-
-    wb.save(EXCEL_FILE)
-    wb.close()
+    changes = {
+        k: data[k] for k in ("name", "phone", "email", "address") if k in data
+    }
+    append_update(CUSTOMERS_JOURNAL, "account", account, changes)
 
 
 # --------------------------------------------------
-# Parcels（這就是你錯誤缺的部分）
+# Parcels
 # --------------------------------------------------
 def append_parcel(record):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Parcels"]
-
-    ws.append([
-        record.get("tracking_number"),
-        record.get("sender_id"),
-        record.get("recipient_name"),
-        record.get("recipient_address"),
-        record.get("weight"),
-        record.get("service_type"),
-        record.get("status"),
-        record.get("amount"),
-        record.get("created_at"),
-    ])
-
-    wb.save(EXCEL_FILE)
-    wb.close()
+    append_record(PARCELS_JOURNAL, {f: record.get(f) for f in PARCEL_FIELDS})
 
 
 def read_parcels():
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Parcels"]
+    return fold_records(PARCELS_JOURNAL, "tracking_number")
 
-    parcels = []
-    for r in ws.iter_rows(min_row=2, values_only=True):
-        parcels.append({
-            "tracking_number": r[0],
-            "sender_id": r[1],
-            "recipient_name": r[2],
-            "recipient_address": r[3],
-            "weight": r[4],
-            "service_type": r[5],
-            "status": r[6],
-            "amount": r[7],
-            "created_at": r[8],
-        })
 
-    wb.close()
-    return parcels
+def update_parcel_amount(tracking_number, amount):
+    append_update(PARCELS_JOURNAL, "tracking_number", tracking_number, {"amount": amount})
 
 
-def update_parcel_amount(tracking_number, amount):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Parcels"]
+def update_parcel_status(tracking_number, status):
+    if not has_key(PARCELS_JOURNAL, "tracking_number", tracking_number):
+        return False
+
+    append_update(PARCELS_JOURNAL, "tracking_number", tracking_number, {"status": status})
+    return True
+
+
+# --------------------------------------------------
+# 匯出 Excel（下載時才產生）
+# xlsxwriter constant_memory：每寫完一列就寫到暫存檔，記憶體不隨筆數成長
+# --------------------------------------------------
+def _write_row(ws, row, values):
+    """write_row 失敗時會略過該列剩下的欄位，回傳非 0 就直接報錯"""
+    rc = ws.write_row(row, 0, values)
+    if rc != 0:
+        raise ValueError(f"{ws.name} 第 {row + 1} 列無法寫入 (xlsxwriter 回傳 {rc})")
+
+
+def export_excel(path=EXCEL_FILE):
+    """
+    先寫到暫存檔再 os.replace：同時有人下載時，拿到的一定是完整的舊檔或新檔
+    任何一列寫入失敗就丟出例外，舊檔保持不動
+    """
+    with _EXPORT_LOCK:
+        tmp = path + ".tmp"
+        # 字串照原樣輸出，不自動轉成網址 / 公式 / 數字
+        wb = xlsxwriter.Workbook(tmp, {
+            "constant_memory": True,
+            "strings_to_urls": False,
+            "strings_to_formulas": False,
+            "strings_to_numbers": False,
+        })
 
-    for row in ws.iter_rows(min_row=2):
-        if row[0].value == tracking_number:
-            row[7].value = amount
-            break
+        try:
+            ws1 = wb.add_worksheet("Customers")
+            _write_row(ws1, 0, CUSTOMER_HEADERS)
+            for i, c in enumerate(read_customers(), start=1):
+                _write_row(ws1, i, [c.get(f) for f in CUSTOMER_FIELDS])
 
-    wb.save(EXCEL_FILE)
-    wb.close()
+            ws2 = wb.add_worksheet("Parcels")
+            _write_row(ws2, 0, PARCEL_HEADERS)
+            for i, p in enumerate(read_parcels(), start=1):
+                _write_row(ws2, i, [p.get(f) for f in PARCEL_FIELDS])
+        finally:
+            wb.close()
 
+        os.replace(tmp, path)
 
-def update_parcel_status(tracking_number, status):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Parcels"]
-
-    updated = False
-    for row in ws.iter_rows(min_row=2):
-        if row[0].value == tracking_number:
-            row[6].value = status
-            updated = True
-            break
-
-    wb.save(EXCEL_FILE)
-    wb.close()
-    return updated
+    return path
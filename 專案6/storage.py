@@ -0,0 +1,147 @@
+import os
+import json
+import logging
+import threading
+
+CUSTOMERS_JOURNAL = "customers.jsonl"
+PARCELS_JOURNAL = "parcels.jsonl"
+
+# 更新紀錄的標記欄位：讀取時依序套用到同 key 的資料上（後寫的覆蓋先寫的）
+UPDATE_FLAG = "_update"
+
+_LOCK = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+# --------------------------------------------------
+# 只能附加的 JSONL 紀錄檔
+# --------------------------------------------------
+def _append_lines(path, lines):
+    """寫入失敗 (例如磁碟滿) 時把檔案截回原本長度，不留下半行讓下一筆接在後面"""
+    data = lines.encode("utf-8")
+    with _LOCK:
+        with open(path, "ab") as f:
+            start = f.tell()
+            try:
+                f.write(data)
+                f.flush()
+            except BaseException:
+                f.truncate(start)
+                raise
+
+
+def append_record(path, record):
+    """新增一筆紀錄：一次 write，不需重寫整個檔案"""
+    _append_lines(path, json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def append_records(path, records):
+    _append_lines(path, "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+
+
+def append_update(path, key_field, key, changes):
+    """更新紀錄：只寫入變更的欄位，讀取時再合併"""
+    record = dict(changes)
+    record[key_field] = key
+    record[UPDATE_FLAG] = True
+    append_record(path, record)
+
+
+def iter_records(path):
+    """
+    依序讀出紀錄
+    最後一行解析失敗 (當機時寫到一半) 只記警告並略過；中間的行壞掉則照常丟出例外
+    """
+    if not os.path.exists(path):
+        return
+
+    with open(path, encoding="utf-8") as f:
+        bad = None
+        for lineno, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if bad is not None:
+                raise bad
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError as e:
+                bad = e
+                bad_lineno = lineno
+                continue
+            yield rec
+
+    if bad is not None:
+        logger.warning("%s 第 %d 行不完整，已略過：%s", path, bad_lineno, bad)
+
+
+def repair_journal(path):
+    """
+    處理沒有換行結尾的最後一行，有修改時回傳 True：
+    內容是完整的 JSON 就補上換行，否則 (寫到一半) 截掉
+    啟動時呼叫，之後新增的紀錄才不會接在半行後面
+    """
+    if not os.path.exists(path):
+        return False
+
+    with _LOCK:
+        with open(path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            if end == 0:
+                return False
+            f.seek(end - 1)
+            if f.read(1) == b"\n":
+                return False
+
+            # 從檔尾往前找最後一個換行
+            cut = 0
+            pos = end
+            while pos > 0:
+                start = max(0, pos - 4096)
+                f.seek(start)
+                i = f.read(pos - start).rfind(b"\n")
+                if i != -1:
+                    cut = start + i + 1
+                    break
+                pos = start
+
+            f.seek(cut)
+            tail = f.read()
+            try:
+                json.loads(tail)
+            except ValueError:
+                f.truncate(cut)
+                logger.warning("%s 最後一行不完整 (%d bytes)，已截掉", path, end - cut)
+            else:
+                f.write(b"\n")
+    return True
+
+
+def fold_records(path, key_field):
+    """
+    依寫入順序重建目前的資料：
+    一般紀錄照順序加入；更新紀錄套用到第一筆相同 key 的資料
+    """
+    rows = []
+    index = {}
+
+    for rec in iter_records(path):
+        key = rec.get(key_field)
+        if rec.pop(UPDATE_FLAG, False):
+            target = index.get(key)
+            if target is not None:
+                target.update(rec)
+            continue
+
+        rows.append(rec)
+        index.setdefault(key, rec)
+
+    return rows
+
+
+def has_key(path, key_field, key):
+    return any(
+        not rec.get(UPDATE_FLAG) and rec.get(key_field) == key
+        for rec in iter_records(path)
+    )
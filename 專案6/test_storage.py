@@ -0,0 +1,58 @@
+"""
+storage 測試：紀錄檔最後一行寫到一半 (當機 / 磁碟滿) 時仍能讀取與繼續寫入
+"""
+
+import json
+import logging
+
+import pytest
+
+import storage
+
+TORN = '{"account": "a1", "name": "A"}\n{"account": "a2", "na'
+
+
+def test_iter_records_skips_torn_last_line(tmp_path, caplog):
+    """最後一行不完整：略過並記警告，前面的紀錄照常讀出"""
+    path = tmp_path / "customers.jsonl"
+    path.write_text(TORN, encoding="utf-8")
+
+    with caplog.at_level(logging.WARNING, logger="storage"):
+        rows = storage.fold_records(str(path), "account")
+
+    assert [r["account"] for r in rows] == ["a1"]
+    assert "不完整" in caplog.text
+
+
+def test_iter_records_raises_on_corrupt_middle_line(tmp_path):
+    """中間的行壞掉不是寫到一半，照常報錯"""
+    path = tmp_path / "customers.jsonl"
+    path.write_text('{"account": "a1"}\nnot json\n{"account": "a2"}\n', encoding="utf-8")
+
+    with pytest.raises(json.JSONDecodeError):
+        list(storage.iter_records(str(path)))
+
+
+def test_repair_journal_truncates_torn_tail(tmp_path):
+    """啟動時截掉半行，之後新增的紀錄不會接在它後面"""
+    path = tmp_path / "customers.jsonl"
+    path.write_text(TORN, encoding="utf-8")
+
+    assert storage.repair_journal(str(path)) is True
+    storage.append_record(str(path), {"account": "a3", "name": "C"})
+
+    rows = storage.fold_records(str(path), "account")
+    assert [r["account"] for r in rows] == ["a1", "a3"]
+
+
+def test_repair_journal_keeps_complete_last_line(tmp_path):
+    """最後一行完整只是少了換行：補上換行，不丟資料"""
+    path = tmp_path / "customers.jsonl"
+    path.write_text('{"account": "a1"}\n{"account": "a2"}', encoding="utf-8")
+
+    assert storage.repair_journal(str(path)) is True
+    assert storage.repair_journal(str(path)) is False
+    storage.append_record(str(path), {"account": "a3"})
+
+    rows = storage.fold_records(str(path), "account")
+    assert [r["account"] for r in rows] == ["a1", "a2", "a3"]
@@ -28,10 +28,44 @@ PARCEL_HEADERS = [
 ]
 
 
+# 結構檢查只需要在啟動時做一次
+_INITIALIZED = False
+
+# 主鍵 → 列號（第一筆相同 key 的那一列），更新時不必逐列掃描
+_CUSTOMER_ROW_INDEX = {}
+_PARCEL_ROW_INDEX = {}
+
+
+def _build_row_index(ws, index):
+    index.clear()
+    for row_idx, (key,) in enumerate(
+        ws.iter_rows(min_row=2, max_col=1, values_only=True), start=2
+    ):
+        if key is not None:
+            index.setdefault(key, row_idx)
+
+
+def _locate_row(ws, index, key):
+    """
+    取得 key 所在的列號，並確認該列第 1 欄真的是這個 key
+    索引查不到或已失準 (多個請求同時存檔後列號錯開、檔案被手動改過、活頁簿重建過)
+    時，依目前載入的工作表重建索引再查
+    """
+    row_idx = index.get(key)
+    if row_idx is not None and row_idx <= ws.max_row and ws.cell(row=row_idx, column=1).value == key:
+        return row_idx
+
+    _build_row_index(ws, index)
+    return index.get(key)
+
+
 # --------------------------------------------------
 # 初始化 Excel
 # --------------------------------------------------
 def initialize_excel():
+    global _INITIALIZED
+    if _INITIALIZED:
+        return
 
     def create_new():
         wb = Workbook()
@@ -43,17 +77,22 @@ def initialize_excel():
         ws2.append(PARCEL_HEADERS)
 
         wb.save(EXCEL_FILE)
+        _CUSTOMER_ROW_INDEX.clear()
+        _PARCEL_ROW_INDEX.clear()
 
     if not os.path.exists(EXCEL_FILE):
         create_new()
+        _INITIALIZED = True
         return
 
     try:
         wb = openpyxl.load_workbook(EXCEL_FILE)
     except BadZipFile:
+        # 檔案壞掉 → 備份後重建，重建完成才視為已初始化
         backup = f"broken_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{EXCEL_FILE}"
         os.rename(EXCEL_FILE, backup)
         create_new()
+        _INITIALIZED = True
         return
 
     changed = False
@@ -85,15 +124,32 @@ def initialize_excel():
     if changed:
         wb.save(EXCEL_FILE)
 
+    _build_row_index(wb["Customers"], _CUSTOMER_ROW_INDEX)
+    _build_row_index(wb["Parcels"], _PARCEL_ROW_INDEX)
+
     wb.close()
+    _INITIALIZED = True
+
+
+def _load_workbook(**kwargs):
+    """
+    開啟活頁簿；啟動後檔案才壞掉或被刪除時，清掉初始化旗標重新檢查
+    (壞檔備份後重建)，再開一次
+    """
+    global _INITIALIZED
+    try:
+        return openpyxl.load_workbook(EXCEL_FILE, **kwargs)
+    except (BadZipFile, FileNotFoundError):
+        _INITIALIZED = False
+        initialize_excel()
+        return openpyxl.load_workbook(EXCEL_FILE, **kwargs)
 
 
 # --------------------------------------------------
 # Customers
 # --------------------------------------------------
 def append_customer(data):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
+    wb = _load_workbook()
     ws = wb["Customers"]
 
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -106,43 +162,46 @@ def append_customer(data):
         data.get("address", ""),
         now,
     ])
+    _CUSTOMER_ROW_INDEX.setdefault(data.get("account", ""), ws.max_row)
 
     wb.save(EXCEL_FILE)
     wb.close()
 
 
 def read_customers():
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Customers"]
+    # 只讀模式：不建立完整的儲存格物件，讀大檔案快很多
+    wb = _load_workbook(read_only=True, data_only=True)
+
+    try:
+        ws = wb["Customers"]
 
-    result = []
-    for r in ws.iter_rows(min_row=2, values_only=True):
-        result.append({
-            "account": r[0],
-            "name": r[1],
-            "phone": r[2],
-            "email": r[3],
-            "address": r[4],
-            "created_at": r[5],
-        })
+        result = []
+        for r in ws.iter_rows(min_row=2, values_only=True):
+            result.append({
+                "account": r[0],
+                "name": r[1],
+                "phone": r[2],
+                "email": r[3],
+                "address": r[4],
+                "created_at": r[5],
+            })
+    finally:
+        wb.close()
 
-    wb.close()
     return result
 
 
 def update_customer(account, data):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
+    wb = _load_workbook()
     ws = wb["Customers"]
+    row_idx = _locate_row(ws, _CUSTOMER_ROW_INDEX, account)
+    if row_idx is None:
+        wb.close()
+        return
 
-    for row in ws.iter_rows(min_row=2):
-        if row[0].value == account:
-            row[1].value = data.get("name", row[1].value)
-            row[2].value = data.get("phone", row[2].value)
-            row[3].value = data.get("email", row[3].value)
-            row[4].value = data.get("address", row[4].value)
-            break
+    for col, field in ((2, "name"), (3, "phone"), (4, "email"), (5, "address")):
+        if field in data:
+            ws.cell(row=row_idx, column=col, value=data[field])
 
     wb.save(EXCEL_FILE)
     wb.close()
@@ -152,8 +211,7 @@ def update_customer(account, data):
 # Parcels（這就是你錯誤缺的部分）
 # --------------------------------------------------
 def append_parcel(record):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
+    wb = _load_workbook()
     ws = wb["Parcels"]
 
     ws.append([
@@ -167,60 +225,61 @@ def append_parcel(record):
         record.get("amount"),
         record.get("created_at"),
     ])
+    _PARCEL_ROW_INDEX.setdefault(record.get("tracking_number"), ws.max_row)
 
     wb.save(EXCEL_FILE)
     wb.close()
 
 
 def read_parcels():
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Parcels"]
+    wb = _load_workbook(read_only=True, data_only=True)
 
-    parcels = []
-    for r in ws.iter_rows(min_row=2, values_only=True):
-        parcels.append({
-            "tracking_number": r[0],
-            "sender_id": r[1],
-            "recipient_name": r[2],
-            "recipient_address": r[3],
-            "weight": r[4],
-            "service_type": r[5],
-            "status": r[6],
-            "amount": r[7],
-            "created_at": r[8],
-        })
+    try:
+        ws = wb["Parcels"]
+
+        parcels = []
+        for r in ws.iter_rows(min_row=2, values_only=True):
+            parcels.append({
+                "tracking_number": r[0],
+                "sender_id": r[1],
+                "recipient_name": r[2],
+                "recipient_address": r[3],
+                "weight": r[4],
+                "service_type": r[5],
+                "status": r[6],
+                "amount": r[7],
+                "created_at": r[8],
+            })
+    finally:
+        wb.close()
 
-    wb.close()
     return parcels
 
 
 def update_parcel_amount(tracking_number, amount):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
+    wb = _load_workbook()
     ws = wb["Parcels"]
+    row_idx = _locate_row(ws, _PARCEL_ROW_INDEX, tracking_number)
+    if row_idx is None:
+        wb.close()
+        return
 
-    for row in ws.iter_rows(min_row=2):
-        if row[0].value == tracking_number:
-            row[7].value = amount
-            break
+    ws.cell(row=row_idx, column=8, value=amount)
 
     wb.save(EXCEL_FILE)
     wb.close()
 
 
 def update_parcel_status(tracking_number, status):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
+    wb = _load_workbook()
     ws = wb["Parcels"]
+    row_idx = _locate_row(ws, _PARCEL_ROW_INDEX, tracking_number)
+    if row_idx is None:
+        wb.close()
+        return False
 
-    updated = False
-    for row in ws.iter_rows(min_row=2):
-        if row[0].value == tracking_number:
-            row[6].value = status
-            updated = True
-            break
+    ws.cell(row=row_idx, column=7, value=status)
 
     wb.save(EXCEL_FILE)
     wb.close()
-    return updated
+    return True
@@ -1,30 +1,67 @@
 from flask import Flask, request, jsonify, send_file
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 import jwt
-from functools import wraps
+import orjson
+import hmac
+import time
+import hashlib
+import base64
+import secrets
+import logging
+from functools import wraps, lru_cache
 from datetime import datetime, timedelta
-import os
 
 from excel_db import (
     EXCEL_FILE,
     initialize_excel,
+    export_snapshot,
+    wait_durable,
     append_customer,
     read_customers,
     update_customer,
     append_parcel,
-    read_parcels,
     update_parcel_amount,
     update_parcel_status,
     append_tracking_event,      
     read_tracking_events,        
     append_account,              
+    append_accounts_bulk,
     read_accounts,               
     find_account,
+    hash_password,
+    find_customer,
     read_all_events_for_search,
     read_customers,       
+    records_view,
+    data_version,
 )
 
+# ------------------------------------------------
+# JSON 改用 orjson：比標準庫快，中文直接輸出 UTF-8 不轉成 \uXXXX
+# ------------------------------------------------
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def json_response(obj):
+    """清單類回應：orjson 直接產生 bytes，不經過 str 再編碼"""
+    return app.response_class(
+        orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS),
+        mimetype="application/json",
+    )
+
+
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
+# request.get_json() 也會經過 app.json，解析請求同樣使用 orjson
+app.json = OrjsonProvider(app)
+# 請求內容超過 1MB 直接回 413，不讀進記憶體解析
+app.config["MAX_CONTENT_LENGTH"] = 1024 * 1024
 CORS(app, resources={r"/*": {"origins": "*"}}, allow_headers=["Content-Type", "Authorization"])
 
 SECRET_KEY = "my_secret_key_for_jwt_12345"
@@ -42,33 +79,67 @@ def init_default_accounts():
         "test1": {"password": "test123", "role": "customer"},
     }
     
-    for username, info in defaults.items():
-        if username not in accounts:
-            append_account({
-                "username": username,
-                "password": info["password"],
-                "role": info["role"]
-            })
+    missing = [
+        {"username": username, "password": info["password"], "role": info["role"]}
+        for username, info in defaults.items()
+        if username not in accounts
+    ]
+    if missing:
+        append_accounts_bulk(missing)
 
 
 # ------------------------------------------------
 # JWT 驗證裝飾器
 # ------------------------------------------------
+def _check_header(token):
+    """
+    驗簽前先看 header：alg 必須是 HS256 (擋掉 alg=none / 演算法混用)
+    格式不對的 token 在這裡就被拒絕，不必走完整的 decode
+    """
+    parts = token.split(".")
+    if len(parts) != 3:
+        raise jwt.InvalidTokenError("Not enough segments")
+
+    try:
+        header_b64 = parts[0]
+        header = orjson.loads(base64.urlsafe_b64decode(header_b64 + "=" * (-len(header_b64) % 4)))
+    except ValueError:  # base64 / JSON 格式錯誤
+        raise jwt.InvalidTokenError("Invalid header")
+
+    if not isinstance(header, dict) or header.get("alg") != "HS256" or header.get("typ") not in ("JWT", None):
+        raise jwt.InvalidTokenError("Unsupported header")
+
+
+# 每個請求都會用到，先綁成模組層級名稱，省去屬性查找
+_jwt_decode = jwt.decode
+_SECRET = SECRET_KEY
+_ALGORITHMS = ("HS256",)
+
+
+@lru_cache(maxsize=4096)
+def _verify(token):
+    """同一個 token 只驗一次簽章；驗證失敗會丟例外，不會被快取"""
+    _check_header(token)
+    return _jwt_decode(token, _SECRET, algorithms=_ALGORITHMS)
+
+
+def decode_token(token):
+    data = _verify(token)
+    # 快取命中時仍要檢查是否已過期
+    if data.get("exp", 0) <= time.time():
+        raise jwt.ExpiredSignatureError("Signature has expired")
+    return dict(data)
+
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-
-        if "Authorization" in request.headers:
-            auth = request.headers["Authorization"]
-            if auth.startswith("Bearer "):
-                token = auth.split(" ")[1]
-
-        if not token:
+        prefix, _, token = request.headers.get("Authorization", "").partition("Bearer ")
+        if prefix or not token:
             return jsonify({"error": "缺少 JWT Token"}), 401
 
         try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+            data = decode_token(token)
             request.user = data
         except jwt.ExpiredSignatureError:
             return jsonify({"error": "Token 已過期"}), 401
@@ -98,7 +169,8 @@ def login():
     if not account:
         return jsonify({"error": "帳號不存在"}), 401
 
-    if account["password"] != password:
+    # Excel 只存雜湊：先雜湊再以固定時間比對，避免從回應時間推測密碼
+    if not hmac.compare_digest(hash_password(password), str(account["password"] or "")):
         return jsonify({"error": "密碼錯誤"}), 401
 
     token = jwt.encode(
@@ -162,6 +234,13 @@ def register_customer_account():
         "billing_preference": billing_preference,
     })
 
+    # 帳號要確定寫進檔案才回覆成功 (物流事件等則不必等待)
+    try:
+        wait_durable()
+    except Exception:
+        logger.exception("註冊帳號 %s 存檔失敗", username)
+        return jsonify({"error": "註冊資料存檔失敗，請稍後再試"}), 500
+
     return jsonify({"message": "註冊成功", "username": username})
 
 
@@ -188,7 +267,7 @@ def list_customers():
         return jsonify({"error": "權限不足"}), 403
 
     customers = read_customers() or []
-    return jsonify(customers)
+    return json_response(customers)
 
 
 @app.route("/api/customers/<account>", methods=["PUT"])
@@ -233,8 +312,7 @@ def create_parcel():
     contents = data.get("contents") or "一般貨物"        # ✅ 新增
     service_type = data.get("service_type") or "標準速遞"
 
-    customers = read_customers()
-    sender_info = next((c for c in customers if c["account"] == sender_id), None)
+    sender_info = find_customer(sender_id)
     
     is_contract = False
     if sender_info and sender_info.get("customer_type") == "CONTRACT":
@@ -243,13 +321,13 @@ def create_parcel():
     if not sender_id or not recipient_name:
         return jsonify({"error": "缺少寄件人或收件人"}), 400
 
-    today = datetime.now().strftime("%Y%m%d")
-    rand4 = str(datetime.now().microsecond)[-4:]
-    tracking_number = f"TRK-{today}-{rand4}"
-    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # 同一個時間點產生追蹤編號、建立時間與事件 ID
+    now = datetime.now()
+    ts_compact = now.strftime("%Y%m%d%H%M%S%f")
+    created_at = now.strftime("%Y-%m-%d %H:%M:%S")
 
     record = {
-        "tracking_number": tracking_number,
+        "tracking_number": None,  # 由 append_parcel 在鎖內產生
         "sender_id": sender_id,
         "recipient_name": recipient_name,
         "recipient_address": recipient_address,
@@ -263,10 +341,12 @@ def create_parcel():
         "created_at": created_at,
     }
 
-    append_parcel(record)
-    
+    # 隨機碼 8 個 hex (每天約 43 億種)，append_parcel 會避開已存在的編號
+    append_parcel(record, lambda: f"TRK-{ts_compact[:8]}-{secrets.token_hex(4)}")
+    tracking_number = record["tracking_number"]
+
     # ✅ 同時記錄第一筆事件
-    event_id = f"EVT-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+    event_id = f"EVT-{ts_compact}"
     append_tracking_event({
         "event_id": event_id,
         "tracking_number": tracking_number,
@@ -309,12 +389,13 @@ def set_parcel_amount():
     update_parcel_amount(tracking, amount_val)
     
     # ✅ 記錄付款事件
-    event_id = f"EVT-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+    now = datetime.now()
+    event_id = f"EVT-{now.strftime('%Y%m%d%H%M%S%f')}"
     append_tracking_event({
         "event_id": event_id,
         "tracking_number": tracking,
         "event_type": "付款完成",
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "timestamp": now.strftime("%Y-%m-%d %H:%M:%S"),
         "location": "線上",
         "operator": request.user.get("username"),
         "description": f"支付金額: {amount_val} 元"
@@ -359,8 +440,9 @@ def set_parcel_status():
         return jsonify({"error": "找不到該追蹤編號"}), 404
 
     # ✅ 同時記錄事件到 TrackingEvents 表
-    event_id = f"EVT-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    now = datetime.now()
+    event_id = f"EVT-{now.strftime('%Y%m%d%H%M%S%f')}"
+    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
     
     append_tracking_event({
         "event_id": event_id,
@@ -395,7 +477,7 @@ def get_parcel_history(tracking_no):
     if not events:
         return jsonify({"message": "查無追蹤紀錄", "events": []}), 200
     
-    return jsonify({
+    return json_response({
         "tracking_number": tracking_no,
         "events": events
     })
@@ -415,7 +497,18 @@ def list_records():
     vehicle_filter = request.args.get("vehicle_id")
     warehouse_filter = request.args.get("warehouse_id")
 
-    parcels = read_parcels() or []
+    # 結果只取決於資料版本、使用者與查詢條件；都沒變就回 304
+    etag = hashlib.blake2b(
+        f"{data_version()}|{username}|{role}|{vehicle_filter}|{warehouse_filter}".encode(),
+        digest_size=8,
+    ).hexdigest()
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    # 物化檢視：不必重新讀取整張 Parcels 表
+    parcels = records_view()
 
     # 權限過濾：如果是客戶，只能看自己的
     if role == "customer":
@@ -458,7 +551,9 @@ def list_records():
             "status": p.get("status"),
         })
 
-    return jsonify(rows)
+    resp = json_response(rows)
+    resp.set_etag(etag)
+    return resp
 
 
 # ------------------------------------------------
@@ -471,11 +566,13 @@ def download_excel():
     if role == "customer":
         return jsonify({"error": "權限不足:客戶不可下載 Excel"}), 403
 
-    initialize_excel()
-    if not os.path.exists(EXCEL_FILE):
-        return jsonify({"error": "找不到 Excel 檔案"}), 500
-
-    return send_file(EXCEL_FILE, as_attachment=True)
+    # 以記憶體中的最新資料產生快照，不直接送出可能正在存檔的 logistics.xlsx
+    return send_file(
+        export_snapshot(),
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        as_attachment=True,
+        download_name=EXCEL_FILE,
+    )
 
 
 # ------------------------------------------------
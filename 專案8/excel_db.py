@@ -1,11 +1,22 @@
+import io
 import os
-from datetime import datetime
+import hashlib
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import date, datetime, time as dt_time
+from operator import itemgetter
 import openpyxl
+import xlsxwriter
 from openpyxl import Workbook
 from zipfile import BadZipFile
 
 EXCEL_FILE = "logistics.xlsx"
 
+logger = logging.getLogger(__name__)
+
 CUSTOMER_HEADERS = [
     "客戶帳號",
     "姓名",
@@ -54,11 +65,48 @@ ACCOUNT_HEADERS = [
     "建立時間",
 ]
 
+# 標題 → 欄位位置 (從 0 起算)
+# 初始化時已把標題補齊到完整欄數，每列讀出來的長度固定，不必再逐列判斷 len()
+CUSTOMER_COL = {h: i for i, h in enumerate(CUSTOMER_HEADERS)}
+PARCEL_COL = {h: i for i, h in enumerate(PARCEL_HEADERS)}
+
+_CUSTOMER_ITEMS = itemgetter(*range(len(CUSTOMER_HEADERS)))
+_PARCEL_ITEMS = itemgetter(*range(len(PARCEL_HEADERS)))
+
+
+# --------------------------------------------------
+# 原子存檔：先寫暫存檔並 fsync，再用 os.replace 換上
+# 當機或下載時都不會遇到寫到一半的 zip
+# --------------------------------------------------
+def _atomic_save(write, path=EXCEL_FILE):
+    """write(tmp_path) 負責把內容寫到暫存檔"""
+    tmp = path + ".tmp"
+    write(tmp)
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
 
 # --------------------------------------------------
 # 初始化 Excel
+# 只在第一次呼叫時檢查 / 建立檔案，之後直接返回
 # --------------------------------------------------
+_INITIALIZED = False
+_INIT_LOCK = threading.Lock()
+
+
 def initialize_excel():
+    global _INITIALIZED
+    if _INITIALIZED:
+        return
+
+    with _INIT_LOCK:
+        if not _INITIALIZED:
+            _check_excel()
+            _INITIALIZED = True
+
+
+def _check_excel():
     def create_new():
         wb = Workbook()
         ws1 = wb.active
@@ -74,20 +122,30 @@ def initialize_excel():
         ws4 = wb.create_sheet("Accounts")
         ws4.append(ACCOUNT_HEADERS)
 
-        wb.save(EXCEL_FILE)
+        _atomic_save(wb.save)
 
     if not os.path.exists(EXCEL_FILE):
         create_new()
         return
 
+    # 先用 read_only 快速檢查結構，正常情況下不必完整載入整本活頁簿
     try:
-        wb = openpyxl.load_workbook(EXCEL_FILE)
+        wb = openpyxl.load_workbook(EXCEL_FILE, read_only=True)
     except BadZipFile:
         backup = f"broken_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{EXCEL_FILE}"
         os.rename(EXCEL_FILE, backup)
         create_new()
         return
 
+    try:
+        layout_ok = _layout_ok(wb)
+    finally:
+        wb.close()
+
+    if layout_ok:
+        return
+
+    wb = openpyxl.load_workbook(EXCEL_FILE)
     changed = False
 
     # Customers
@@ -130,207 +188,535 @@ def initialize_excel():
         changed = True
 
     if changed:
-        wb.save(EXCEL_FILE)
+        _atomic_save(wb.save)
 
     wb.close()
 
 
+def _layout_ok(wb):
+    """四張工作表都在，且 Customers / Parcels 標題欄數足夠"""
+    for name in ("Customers", "Parcels", "TrackingEvents", "Accounts"):
+        if name not in wb.sheetnames:
+            return False
+
+    for name, headers in (("Customers", CUSTOMER_HEADERS), ("Parcels", PARCEL_HEADERS)):
+        header = next(wb[name].iter_rows(max_row=1, values_only=True), ())
+        if len(header) < len(headers):
+            return False
+
+    return True
+
+
+# --------------------------------------------------
+# 快取的 Workbook：啟動後只載入一次，修改都在記憶體中進行，
+# 再由單一背景寫入執行緒把短時間內的修改合併成一次存檔
+# (不再每個請求都 load + save 整個檔案)
+# --------------------------------------------------
+FLUSH_MAX_OPS = 100
+FLUSH_WINDOW = 0.2  # 秒
+
+_WB = None
+_DIRTY = False
+_LOCK = threading.RLock()
+
+# 資料版本：每次修改 +1，搭配啟動時間給 ETag 使用
+_STARTED_AT = time.time()
+_VERSION = 0
+
+# 寫入通知：None 表示有修改；threading.Event 表示呼叫端在等存檔完成
+_WRITE_QUEUE = queue.Queue()
+
+# 主鍵 → 列號 的索引，查詢與更新不必掃過整張表
+_ACCOUNTS_IDX = {}
+_CUSTOMERS_IDX = {}
+_PARCELS_IDX = {}
+
+
+def _build_indexes(wb):
+    _ACCOUNTS_IDX.clear()
+    _CUSTOMERS_IDX.clear()
+    _PARCELS_IDX.clear()
+
+    # 帳號重複時以最後一筆為準 (與 read_accounts 的 dict 行為一致)
+    for i, (key,) in enumerate(wb["Accounts"].iter_rows(min_row=2, max_col=1, values_only=True), start=2):
+        if key:
+            _ACCOUNTS_IDX[key] = i
+
+    # 客戶 / 包裹重複時以第一筆為準 (與原本找到就 break 一致)
+    for i, (key,) in enumerate(wb["Customers"].iter_rows(min_row=2, max_col=1, values_only=True), start=2):
+        _CUSTOMERS_IDX.setdefault(key, i)
+
+    for i, (key,) in enumerate(wb["Parcels"].iter_rows(min_row=2, max_col=1, values_only=True), start=2):
+        _PARCELS_IDX.setdefault(key, i)
+
+
+def _get_wb():
+    global _WB
+    with _LOCK:
+        if _WB is None:
+            initialize_excel()
+            _WB = openpyxl.load_workbook(EXCEL_FILE)
+            _NEXT_ROW.clear()
+            _build_indexes(_WB)
+            _build_records_view(_WB)
+            if _hash_plaintext_passwords(_WB):
+                _mark_dirty()
+        return _WB
+
+
+def _row_values(ws, row):
+    return tuple(c.value for c in ws[row])
+
+
+# 每張表下一個空白列號；append 後直接 +1，不必每次重算 ws.max_row
+_NEXT_ROW = {}
+
+
+def _fast_append(ws, values):
+    """
+    以 ws.cell 直接寫入下一列，回傳寫入的列號
+    某一格寫入失敗 (例如含控制字元) 時整列移除再往上丟，不留下半列被存檔
+    """
+    row = _NEXT_ROW.get(ws.title)
+    if row is None:
+        row = ws.max_row + 1
+
+    try:
+        for col, value in enumerate(values, start=1):
+            ws.cell(row=row, column=col, value=value)
+    except Exception:
+        # row 在所有資料之後，刪掉它不會移動其他列
+        ws.delete_rows(row)
+        raise
+
+    _NEXT_ROW[ws.title] = row + 1
+    return row
+
+
+def _mark_dirty():
+    global _DIRTY, _VERSION
+    _DIRTY = True
+    _VERSION += 1
+    _WRITE_QUEUE.put(None)
+
+
+def data_version():
+    return f"{_STARTED_AT}:{_VERSION}"
+
+
+def wait_durable(timeout=5):
+    """
+    等背景執行緒把目前為止的修改存檔 (註冊等需要確定落地的操作使用)
+    逾時丟 TimeoutError；存檔失敗則把背景執行緒遇到的例外原樣丟出
+    """
+    done = threading.Event()
+    done.error = None
+    _WRITE_QUEUE.put(done)
+    if not done.wait(timeout):
+        raise TimeoutError(f"等待存檔超過 {timeout} 秒")
+    if done.error is not None:
+        raise done.error
+
+
+def flush_excel():
+    """把記憶體中的修改寫回檔案 (沒有修改就不做事)"""
+    global _DIRTY
+    with _LOCK:
+        if _WB is None or not _DIRTY:
+            return
+        _atomic_save(lambda tmp: _write_workbook(_WB, tmp))
+        _DIRTY = False
+
+
+def _writer_loop():
+    """收集 FLUSH_WINDOW 內 (最多 FLUSH_MAX_OPS 筆) 的修改只存檔一次；有人在等就立刻存"""
+    while True:
+        item = _WRITE_QUEUE.get()
+        waiters = [item] if item is not None else []
+        drained = 1
+        deadline = time.monotonic() + FLUSH_WINDOW
+
+        while not waiters and drained < FLUSH_MAX_OPS:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = _WRITE_QUEUE.get(timeout=timeout)
+            except queue.Empty:
+                break
+            drained += 1
+            if item is not None:
+                waiters.append(item)
+
+        error = None
+        try:
+            flush_excel()
+        except Exception as e:
+            # _DIRTY 仍為 True，下一批修改會再試著存檔
+            logger.exception("背景存檔失敗")
+            error = e
+        finally:
+            for done in waiters:
+                done.error = error
+                done.set()
+
+
+def _write_workbook(wb, path):
+    """
+    用 xlsxwriter (constant_memory) 輸出記憶體中的活頁簿：
+    逐列串流寫入，不必像 openpyxl.save 先建出整份 XML
+    """
+    # 這個檔案是唯一的正本：字串一律照原樣存，不自動轉成網址 / 公式 / 數字
+    out = xlsxwriter.Workbook(path, {
+        "constant_memory": True,
+        "default_date_format": "yyyy-mm-dd hh:mm:ss",
+        "strings_to_urls": False,
+        "strings_to_formulas": False,
+        "strings_to_numbers": False,
+    })
+
+    try:
+        for ws in wb.worksheets:
+            sheet = out.add_worksheet(ws.title)
+            for i, row in enumerate(ws.iter_rows(values_only=True)):
+                for j, value in enumerate(row):
+                    _write_cell(sheet, i, j, value)
+    finally:
+        out.close()
+
+
+def _write_cell(sheet, row, col, value):
+    """依型別寫入單一儲存格；xlsxwriter 寫不進去時 (例如字串超過 32767 字) 直接報錯，不默默丟資料"""
+    if value is None:
+        return
+    if isinstance(value, bool):
+        rc = sheet.write_boolean(row, col, value)
+    elif isinstance(value, (int, float)):
+        rc = sheet.write_number(row, col, value)
+    elif isinstance(value, (datetime, date, dt_time)):
+        rc = sheet.write_datetime(row, col, value)
+    else:
+        rc = sheet.write_string(row, col, str(value))
+
+    if rc != 0:
+        raise ValueError(f"{sheet.name}!R{row + 1}C{col + 1} 無法寫入 (xlsxwriter 回傳 {rc})")
+
+
+threading.Thread(target=_writer_loop, name="excel-writer", daemon=True).start()
+
+# 程式結束前把還沒存的修改寫回去
+atexit.register(flush_excel)
+
+
+def export_snapshot():
+    """
+    下載用：把記憶體中的資料寫成一份獨立的 xlsx (BytesIO)
+    write_only 模式逐列輸出，不會拿到正在被背景存檔的檔案
+    """
+    out = Workbook(write_only=True)
+
+    with _LOCK:
+        for ws in _get_wb().worksheets:
+            sheet = out.create_sheet(ws.title)
+            for row in ws.iter_rows(values_only=True):
+                sheet.append(row)
+
+    buf = io.BytesIO()
+    out.save(buf)
+    buf.seek(0)
+    return buf
+
+
 # --------------------------------------------------
 # 帳號管理 (解決記憶體問題)
 # --------------------------------------------------
+def hash_password(password):
+    """Accounts 的密碼欄只存 sha256 雜湊 (hex)"""
+    return hashlib.sha256(str(password).encode()).hexdigest()
+
+
+def _is_password_hash(value):
+    return (
+        isinstance(value, str)
+        and len(value) == 64
+        and all(c in "0123456789abcdef" for c in value)
+    )
+
+
+def _hash_plaintext_passwords(wb):
+    """舊檔案裡的明碼密碼改存雜湊，有改到回傳 True"""
+    changed = False
+    for row in wb["Accounts"].iter_rows(min_row=2, min_col=2, max_col=2):
+        cell = row[0]
+        if cell.value is not None and not _is_password_hash(cell.value):
+            cell.value = hash_password(cell.value)
+            changed = True
+    return changed
+
+
 def append_account(account_data):
     """新增帳號到 Excel"""
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Accounts"]
-    
+    append_accounts_bulk([account_data])
+
+
+def append_accounts_bulk(accounts):
+    """一次新增多個帳號，只觸發一次存檔"""
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    ws.append([
-        account_data.get("username", ""),
-        account_data.get("password", ""),  # 實際應加密
-        account_data.get("role", "customer"),
-        now,
-    ])
-    
-    wb.save(EXCEL_FILE)
-    wb.close()
+
+    with _LOCK:
+        ws = _get_wb()["Accounts"]
+        for account_data in accounts:
+            row = _fast_append(ws, (
+                account_data.get("username", ""),
+                hash_password(account_data.get("password", "")),
+                account_data.get("role", "customer"),
+                now,
+            ))
+            if account_data.get("username"):
+                _ACCOUNTS_IDX[account_data["username"]] = row
+        _mark_dirty()
 
 
 def read_accounts():
     """讀取所有帳號 (取代記憶體 ACCOUNTS)"""
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Accounts"]
-    
     accounts = {}
-    for r in ws.iter_rows(min_row=2, values_only=True):
-        if r[0]:  # 帳號不為空
-            accounts[r[0]] = {
-                "password": r[1],
-                "role": r[2],
-                "created_at": r[3],
-            }
-    
-    wb.close()
+    with _LOCK:
+        ws = _get_wb()["Accounts"]
+        for r in ws.iter_rows(min_row=2, values_only=True):
+            if r[0]:  # 帳號不為空
+                accounts[r[0]] = _account_from_row(r)
+
     return accounts
 
 
+def _account_from_row(r):
+    return {
+        "password": r[1],
+        "role": r[2],
+        "created_at": r[3],
+    }
+
+
 def find_account(username):
     """查詢單一帳號"""
-    accounts = read_accounts()
-    return accounts.get(username)
+    with _LOCK:
+        ws = _get_wb()["Accounts"]
+        row = _ACCOUNTS_IDX.get(username)
+        if row is None:
+            return None
+        return _account_from_row(_row_values(ws, row))
 
 
 # --------------------------------------------------
 # Customers (修改版)
 # --------------------------------------------------
 def append_customer(data):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Customers"]
-
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    ws.append([
-        data.get("account", ""),
-        data.get("name", ""),
-        data.get("phone", ""),
-        data.get("email", ""),
-        data.get("address", ""),
-        data.get("customer_type", "NON_CONTRACT"),  # ✅ 新增
-        data.get("billing_preference", "COD"),      # ✅ 新增
-        now,
-    ])
-
-    wb.save(EXCEL_FILE)
-    wb.close()
+    with _LOCK:
+        ws = _get_wb()["Customers"]
+        row = _fast_append(ws, (
+            data.get("account", ""),
+            data.get("name", ""),
+            data.get("phone", ""),
+            data.get("email", ""),
+            data.get("address", ""),
+            data.get("customer_type", "NON_CONTRACT"),  # ✅ 新增
+            data.get("billing_preference", "COD"),      # ✅ 新增
+            now,
+        ))
+        _CUSTOMERS_IDX.setdefault(data.get("account", ""), row)
+        _mark_dirty()
 
 
 def read_customers():
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Customers"]
-
     result = []
-    for r in ws.iter_rows(min_row=2, values_only=True):
-        result.append({
-            "account": r[0],
-            "name": r[1],
-            "phone": r[2],
-            "email": r[3],
-            "address": r[4],
-            "customer_type": r[5] if len(r) > 5 else "NON_CONTRACT",
-            "billing_preference": r[6] if len(r) > 6 else "COD",
-            "created_at": r[7] if len(r) > 7 else r[5],
-        })
+    with _LOCK:
+        ws = _get_wb()["Customers"]
+        for r in ws.iter_rows(min_row=2, values_only=True):
+            result.append(_customer_from_row(r))
 
-    wb.close()
     return result
 
 
+def _customer_from_row(r):
+    (account, name, phone, email, address,
+     customer_type, billing_preference, created_at) = _CUSTOMER_ITEMS(r)
+    return {
+        "account": account,
+        "name": name,
+        "phone": phone,
+        "email": email,
+        "address": address,
+        "customer_type": customer_type,
+        "billing_preference": billing_preference,
+        "created_at": created_at,
+    }
+
+
+def find_customer(account):
+    """以客戶帳號查詢單一客戶"""
+    with _LOCK:
+        ws = _get_wb()["Customers"]
+        row = _CUSTOMERS_IDX.get(account)
+        if row is None:
+            return None
+        return _customer_from_row(_row_values(ws, row))
+
+
 def update_customer(account, data):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Customers"]
-
-    for row in ws.iter_rows(min_row=2):
-        if row[0].value == account:
-            row[1].value = data.get("name", row[1].value)
-            row[2].value = data.get("phone", row[2].value)
-            row[3].value = data.get("email", row[3].value)
-            row[4].value = data.get("address", row[4].value)
-            row[5].value = data.get("customer_type", row[5].value)  # ✅
-            row[6].value = data.get("billing_preference", row[6].value)  # ✅
-            break
-
-    wb.save(EXCEL_FILE)
-    wb.close()
+    with _LOCK:
+        ws = _get_wb()["Customers"]
+        row = _CUSTOMERS_IDX.get(account)
+        if row is None:
+            return
+
+        for header, key in (
+            ("姓名", "name"),
+            ("電話", "phone"),
+            ("Email", "email"),
+            ("地址", "address"),
+            ("客戶類型", "customer_type"),  # ✅
+            ("帳單偏好", "billing_preference"),  # ✅
+        ):
+            if key in data:
+                ws.cell(row=row, column=CUSTOMER_COL[header] + 1).value = data[key]
+        _mark_dirty()
 
 
 # --------------------------------------------------
 # Parcels (修改版)
 # --------------------------------------------------
-def append_parcel(record):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Parcels"]
-
-    ws.append([
-        record.get("tracking_number"),
-        record.get("sender_id"),
-        record.get("recipient_name"),
-        record.get("recipient_address"),
-        record.get("weight"),
-        record.get("package_type", "中型箱"),      # ✅ 新增
-        record.get("declared_value", 0),          # ✅ 新增
-        record.get("contents", "一般貨物"),       # ✅ 新增
-        record.get("service_type"),
-        record.get("status"),
-        record.get("amount"),
-        record.get("created_at"),
-        record.get("payment_status", "Unpaid"),
-    ])
-
-    wb.save(EXCEL_FILE)
-    wb.close()
+def append_parcel(record, new_tracking_number=None):
+    """
+    新增包裹
+    有給 new_tracking_number (產生追蹤編號的函式) 時，在鎖內重抽到不與現有包裹重複為止，
+    結果寫回 record["tracking_number"]
+    """
+    with _LOCK:
+        ws = _get_wb()["Parcels"]
+        if new_tracking_number is not None:
+            tracking_number = new_tracking_number()
+            while tracking_number in _PARCELS_IDX:
+                tracking_number = new_tracking_number()
+            record["tracking_number"] = tracking_number
+
+        values = (
+            record.get("tracking_number"),
+            record.get("sender_id"),
+            record.get("recipient_name"),
+            record.get("recipient_address"),
+            record.get("weight"),
+            record.get("package_type", "中型箱"),      # ✅ 新增
+            record.get("declared_value", 0),          # ✅ 新增
+            record.get("contents", "一般貨物"),       # ✅ 新增
+            record.get("service_type"),
+            record.get("status"),
+            record.get("amount"),
+            record.get("created_at"),
+            record.get("payment_status", "Unpaid"),
+        )
+        row = _fast_append(ws, values)
+        _PARCELS_IDX.setdefault(record.get("tracking_number"), row)
+        _add_to_records_view(_parcel_from_row(values))
+        _mark_dirty()
+
+
+def _parcel_from_row(r):
+    (tracking_number, sender_id, recipient_name, recipient_address, weight,
+     package_type, declared_value, contents, service_type, status, amount,
+     created_at, payment_status) = _PARCEL_ITEMS(r)
+    return {
+        "tracking_number": tracking_number,
+        "sender_id": sender_id,
+        "recipient_name": recipient_name,
+        "recipient_address": recipient_address,
+        "weight": weight,
+        "package_type": package_type,
+        "declared_value": declared_value,
+        "contents": contents,
+        "service_type": service_type,
+        "status": status,
+        "amount": amount,
+        "created_at": created_at,
+        "payment_status": payment_status,
+    }
+
+
+# --------------------------------------------------
+# 包裹的物化檢視：載入時掃一次 Parcels，之後由寫入函式同步維護
+# /records 等查詢直接用，不必每次重新讀整張表
+# --------------------------------------------------
+_RECORDS_VIEW = []
+_RECORDS_BY_TN = {}
+
+
+def _build_records_view(wb):
+    _RECORDS_VIEW.clear()
+    _RECORDS_BY_TN.clear()
+    for r in wb["Parcels"].iter_rows(min_row=2, values_only=True):
+        _add_to_records_view(_parcel_from_row(r))
+
+
+def _add_to_records_view(parcel):
+    _RECORDS_VIEW.append(parcel)
+    _RECORDS_BY_TN.setdefault(parcel["tracking_number"], parcel)
+
+
+def records_view():
+    """目前所有包裹 (唯讀，請勿修改回傳的 dict)"""
+    with _LOCK:
+        _get_wb()
+        return list(_RECORDS_VIEW)
 
 
 def read_parcels():
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Parcels"]
-
-    parcels = []
-    for r in ws.iter_rows(min_row=2, values_only=True):
-        parcels.append({
-            "tracking_number": r[0],
-            "sender_id": r[1],
-            "recipient_name": r[2],
-            "recipient_address": r[3],
-            "weight": r[4],
-            "package_type": r[5] if len(r) > 5 else "",
-            "declared_value": r[6] if len(r) > 6 else 0,
-            "contents": r[7] if len(r) > 7 else "",
-            "service_type": r[8] if len(r) > 8 else r[5],
-            "status": r[9] if len(r) > 9 else r[6],
-            "amount": r[10] if len(r) > 10 else r[7],
-            "created_at": r[11] if len(r) > 11 else r[8],
-            "payment_status": r[12] if len(r) > 12 else "Unpaid",
-        })
+    return [dict(p) for p in records_view()]
 
-    wb.close()
-    return parcels
 
+def _parcel_row(wb, tracking_number):
+    """
+    以索引取得包裹列號
+    索引查不到時退回掃描：若資料其實存在，代表索引已失準，整個重建後再查
+    """
+    row = _PARCELS_IDX.get(tracking_number)
+    if row is not None:
+        return row
 
-def update_parcel_amount(tracking_number, amount):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Parcels"]
+    for (key,) in wb["Parcels"].iter_rows(min_row=2, max_col=1, values_only=True):
+        if key == tracking_number:
+            _build_indexes(wb)
+            _build_records_view(wb)
+            return _PARCELS_IDX.get(tracking_number)
 
-    for row in ws.iter_rows(min_row=2):
-        if row[0].value == tracking_number:
-            row[10].value = amount  # 調整索引
-            break
+    return None
 
-    wb.save(EXCEL_FILE)
-    wb.close()
 
+def update_parcel_amount(tracking_number, amount):
+    with _LOCK:
+        wb = _get_wb()
+        ws = wb["Parcels"]
+        row = _parcel_row(wb, tracking_number)
+        if row is None:
+            return
 
-def update_parcel_status(tracking_number, status):
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["Parcels"]
+        ws.cell(row=row, column=PARCEL_COL["金額"] + 1).value = amount
+        _RECORDS_BY_TN[tracking_number]["amount"] = amount
+        _mark_dirty()
 
-    updated = False
-    for row in ws.iter_rows(min_row=2):
-        if row[0].value == tracking_number:
-            row[9].value = status  # 調整索引
-            updated = True
-            break
 
-    wb.save(EXCEL_FILE)
-    wb.close()
-    return updated
+def update_parcel_status(tracking_number, status):
+    with _LOCK:
+        wb = _get_wb()
+        ws = wb["Parcels"]
+        row = _parcel_row(wb, tracking_number)
+        if row is None:
+            return False
+
+        ws.cell(row=row, column=PARCEL_COL["狀態"] + 1).value = status
+        _RECORDS_BY_TN[tracking_number]["status"] = status
+        _mark_dirty()
+        return True
 
 
 # --------------------------------------------------
@@ -338,90 +724,70 @@ def update_parcel_status(tracking_number, status):
 # --------------------------------------------------
 def append_tracking_event(event):
     """記錄物流事件"""
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["TrackingEvents"]
-    
-    ws.append([
-        event.get("event_id"),
-        event.get("tracking_number"),
-        event.get("event_type"),
-        event.get("timestamp"),
-        event.get("location", ""),
-        event.get("vehicle_id", ""),
-        event.get("warehouse_id", ""),
-        event.get("operator", ""),
-        event.get("description", ""),
-    ])
-    
-    wb.save(EXCEL_FILE)
-    wb.close()
+    with _LOCK:
+        ws = _get_wb()["TrackingEvents"]
+        _fast_append(ws, (
+            event.get("event_id"),
+            event.get("tracking_number"),
+            event.get("event_type"),
+            event.get("timestamp"),
+            event.get("location", ""),
+            event.get("vehicle_id", ""),
+            event.get("warehouse_id", ""),
+            event.get("operator", ""),
+            event.get("description", ""),
+        ))
+        _mark_dirty()
+
+
+def _event_from_row(r):
+    return {
+        "event_id": r[0],
+        "tracking_number": r[1],
+        "event_type": r[2],
+        "timestamp": r[3],
+        "location": r[4],
+        "vehicle_id": r[5],
+        "warehouse_id": r[6],
+        "operator": r[7],
+        "description": r[8],
+    }
 
 
 def read_tracking_events(tracking_number):
     """查詢包裹的完整追蹤歷史"""
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["TrackingEvents"]
-    
-    events = []
-    for r in ws.iter_rows(min_row=2, values_only=True):
-        if r[1] == tracking_number:  # 追蹤編號匹配
-            events.append({
-                "event_id": r[0],
-                "tracking_number": r[1],
-                "event_type": r[2],
-                "timestamp": r[3],
-                "location": r[4],
-                "vehicle_id": r[5],
-                "warehouse_id": r[6],
-                "operator": r[7],
-                "description": r[8],
-            })
-    
-    wb.close()
-    # 按時間排序
-    events.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+    with _LOCK:
+        ws = _get_wb()["TrackingEvents"]
+        # 先只掃「追蹤編號」一欄，符合的列才取出整列建立 dict
+        keys = ws.iter_rows(min_row=2, min_col=2, max_col=2, values_only=True)
+        events = [
+            _event_from_row(_row_values(ws, i))
+            for i, (tn,) in enumerate(keys, start=2)
+            if tn == tracking_number
+        ]
+
+    # 按時間排序 (itemgetter 為 C 實作，比 lambda 快)
+    events.sort(key=itemgetter("timestamp"), reverse=True)
     return events
 
 
 def read_all_tracking_events():
     """讀取所有事件 (用於報表分析)"""
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["TrackingEvents"]
-    
-    events = []
-    for r in ws.iter_rows(min_row=2, values_only=True):
-        events.append({
-            "event_id": r[0],
-            "tracking_number": r[1],
-            "event_type": r[2],
-            "timestamp": r[3],
-            "location": r[4],
-            "vehicle_id": r[5],
-            "warehouse_id": r[6],
-            "operator": r[7],
-            "description": r[8],
-        })
-    
-    wb.close()
-    return events
+    with _LOCK:
+        ws = _get_wb()["TrackingEvents"]
+        return [_event_from_row(r) for r in ws.iter_rows(min_row=2, values_only=True)]
 
 def read_all_events_for_search():
-    initialize_excel()
-    wb = openpyxl.load_workbook(EXCEL_FILE)
-    ws = wb["TrackingEvents"]
-    
     events = []
-    # 從第二行開始讀取 (第一行是標題)
-    for r in ws.iter_rows(min_row=2, values_only=True):
-        # r[1] 是追蹤編號, r[5] 是車輛ID, r[6] 是倉儲ID
-        events.append({
-            "tracking_number": r[1],
-            "vehicle_id": r[5] if len(r) > 5 else "",
-            "warehouse_id": r[6] if len(r) > 6 else "",
-        })
-    
-    wb.close()
+    with _LOCK:
+        ws = _get_wb()["TrackingEvents"]
+        # 從第二行開始讀取 (第一行是標題)，只取第 2~7 欄
+        for r in ws.iter_rows(min_row=2, min_col=2, max_col=7, values_only=True):
+            # r[0] 是追蹤編號, r[4] 是車輛ID, r[5] 是倉儲ID
+            events.append({
+                "tracking_number": r[0],
+                "vehicle_id": r[4],
+                "warehouse_id": r[5],
+            })
+
     return events
\ No newline at end of file
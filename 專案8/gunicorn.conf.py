@@ -0,0 +1,17 @@
+import multiprocessing
+
+# 啟動方式：gunicorn -c gunicorn.conf.py wsgi:application
+bind = "0.0.0.0:5000"
+
+# 資料快取在行程自己的記憶體 (excel_db 的 Workbook 與索引)，
+# 多個 worker 會各自持有一份、互相覆蓋存檔 → 固定 1 個 worker，
+# 用執行緒處理並行請求 (excel_db 內以 lock 保護)
+workers = 1
+worker_class = "gthread"
+threads = multiprocessing.cpu_count() * 2 + 1
+
+# 背景存檔執行緒在 import 時啟動，fork 後不會跟著過去，
+# 所以不預先載入 app，讓 worker 自己初始化
+preload_app = False
+
+timeout = 60
@@ -0,0 +1,36 @@
+"""
+excel_db 測試：寫入失敗時不能在快取的活頁簿留下半列資料
+"""
+
+import pytest
+import openpyxl
+from openpyxl.utils.exceptions import IllegalCharacterError
+
+import excel_db
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """每個測試用 tmp_path 裡的全新活頁簿，不動到專案裡的 logistics.xlsx"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(excel_db, "_INITIALIZED", False)
+    monkeypatch.setattr(excel_db, "_WB", None)
+    yield excel_db
+    excel_db.wait_durable()
+
+
+def test_append_customer_illegal_char_leaves_no_partial_row(db):
+    """含控制字元的資料寫入失敗後，工作表與存檔都不會有這筆的殘列"""
+    with pytest.raises(IllegalCharacterError):
+        db.append_customer({"account": "bad", "name": "a\x01b"})
+
+    assert db.find_customer("bad") is None
+
+    db.append_customer({"account": "good", "name": "ok"})
+    ws = db._get_wb()["Customers"]
+    assert [r[0] for r in ws.iter_rows(min_row=2, values_only=True)] == ["good"]
+
+    db.wait_durable()
+    saved = openpyxl.load_workbook(db.EXCEL_FILE, read_only=True)
+    assert [r[0] for r in saved["Customers"].iter_rows(min_row=2, values_only=True)] == ["good"]
+    saved.close()
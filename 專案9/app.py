@@ -1,40 +1,97 @@
 from flask import Flask, request, jsonify, send_file
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 import jwt
+import orjson
 from functools import wraps
 from datetime import datetime, timedelta
 import os
-import io
 import csv
+import time
+import hashlib
+import threading
+import secrets
+import uuid
+
+from sqlalchemy.exc import IntegrityError
 
 from db_operations import (
     initialize_database,
     append_customer,
     read_customers,
     update_customer,
-    append_parcel,
-    read_parcels,
-    update_parcel_amount,
-    update_parcel_status,
-    append_tracking_event,
+    append_parcel_with_event,
+    iter_parcels,
+    data_fingerprint,
+    get_parcel_status,
+    update_parcel_amount_with_event,
+    update_parcel_status_with_event,
     read_tracking_events,
     append_account,
-    read_accounts,
     find_account,
-    read_all_events_for_search,
+    read_records_rows,
     delete_parcel_by_tracking,
 )
 
+# ------------------------------------------------
+# JSON 改用 orjson：比標準庫快，中文直接輸出 UTF-8 不轉成 \uXXXX
+# datetime 統一輸出成 "YYYY-MM-DD HH:MM:SS"，跟資料庫讀出來的字串格式一致
+# ------------------------------------------------
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.strftime("%Y-%m-%d %H:%M:%S")
+    raise TypeError
+
+
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj,
+            default=_json_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+# jsonify() 與 request.get_json() 都會經過 app.json
+app.json = OrjsonProvider(app)
 CORS(app, resources={r"/*": {"origins": "*"}}, allow_headers=["Content-Type", "Authorization"])
 
 SECRET_KEY = "my_secret_key_for_jwt_12345"
 
+# 共用同一個 PyJWT 實例與預先編碼好的金鑰，不必每次呼叫都重新準備
+_jwt = jwt.PyJWT()
+_SECRET_BYTES = SECRET_KEY.encode()
+_ALGORITHMS = ["HS256"]
+
+# ------------------------------------------------
+# 權限與狀態常數 (模組層級 frozenset，不必每個請求重建 list)
+# ------------------------------------------------
+WRITE_ROLES = frozenset({"staff", "admin"})
+DRIVER_ALLOWED = frozenset({"已裝車", "配送中", "已送達", "延誤", "遺失", "損毀"})
+WAREHOUSE_ALLOWED = frozenset({"已收件", "進入倉儲", "已裝車", "退回", "損毀"})
+ABNORMAL = frozenset({"遺失", "損毀", "退回"})
+ABNORMAL_EXIT = frozenset({"處理中", "退回"})  # 異常包裹一般人員仍可改成的狀態
+COD_METHODS = frozenset({"cash", "cod"})
+
+# 追蹤編號撞號 (主鍵衝突) 時最多重新產生幾次
+TRACKING_NUMBER_RETRIES = 5
+
+# JWT 驗證快取：同一個 token 短時間內只驗一次簽章 (key 為 sha256(token))
+# 到期時間取 TTL 與 token exp 較早者，過期的 token 一定會重新驗證並回 401
+TOKEN_CACHE_TTL = 60  # 秒
+TOKEN_CACHE_MAX = 10_000
+
+_tok_cache = {}
+_tok_lock = threading.Lock()
+
 # ------------------------------------------------
 # 初始化預設帳號
 # ------------------------------------------------
 def init_default_accounts():
-    accounts = read_accounts()
     defaults = {
         "staff1": {"password": "staff123", "role": "staff"},
         "admin1": {"password": "admin123", "role": "admin"},
@@ -43,7 +100,7 @@ def init_default_accounts():
         "test1": {"password": "test123", "role": "customer"},
     }
     for username, info in defaults.items():
-        if username not in accounts:
+        if not find_account(username):
             append_account({
                 "username": username,
                 "password": info["password"],
@@ -56,27 +113,64 @@ def init_default_accounts():
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        if "Authorization" in request.headers:
-            auth = request.headers["Authorization"]
-            if auth.startswith("Bearer "):
-                token = auth.split(" ")[1]
-
-        if not token:
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme != "Bearer" or not token:
             return jsonify({"error": "缺少 JWT Token"}), 401
 
+        key = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        with _tok_lock:
+            cached = _tok_cache.get(key)
+
+        if cached and cached[1] > now:
+            request.user = cached[0]
+            return f(*args, **kwargs)
+
         try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            request.user = data
+            data = _jwt.decode(token, _SECRET_BYTES, algorithms=_ALGORITHMS)
         except jwt.ExpiredSignatureError:
             return jsonify({"error": "Token 已過期"}), 401
         except Exception:
             return jsonify({"error": "無效 Token"}), 401
 
+        # 只快取驗證成功的 token
+        expires = min(now + TOKEN_CACHE_TTL, data.get("exp", now))
+        with _tok_lock:
+            if len(_tok_cache) >= TOKEN_CACHE_MAX:
+                _tok_cache.clear()
+            _tok_cache[key] = (data, expires)
+
+        request.user = data
         return f(*args, **kwargs)
 
     return decorated
 
+# ------------------------------------------------
+# 條件式 GET：結果只取決於資料版本、使用者與網址，都沒變就回 304
+# (不查資料庫、不編碼 JSON)；no-cache 讓瀏覽器每次都帶 ETag 回來確認
+# ------------------------------------------------
+def _request_etag():
+    user = request.user
+    return hashlib.blake2b(
+        f"{data_fingerprint()}|{user.get('username')}|{user.get('role')}|{request.full_path}".encode(),
+        digest_size=8,
+    ).hexdigest()
+
+
+def _not_modified(etag):
+    if etag not in request.if_none_match:
+        return None
+    resp = app.response_class(status=304)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+def _cacheable(resp, etag):
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
 # ------------------------------------------------
 # 登入
 # ------------------------------------------------
@@ -96,13 +190,13 @@ def login():
     if account["password"] != password:
         return jsonify({"error": "密碼錯誤"}), 401
 
-    token = jwt.encode(
+    token = _jwt.encode(
         {
             "username": username,
             "role": account["role"],
             "exp": datetime.utcnow() + timedelta(hours=4),
         },
-        SECRET_KEY,
+        _SECRET_BYTES,
         algorithm="HS256",
     )
 
@@ -157,7 +251,7 @@ def register_customer_account():
 @app.route("/api/customers", methods=["POST"])
 @token_required
 def create_customer():
-    if request.user.get("role") not in ["staff", "admin"]:
+    if request.user.get("role") not in WRITE_ROLES:
         return jsonify({"error": "權限不足"}), 403
     data = request.get_json() or {}
     append_customer(data)
@@ -167,20 +261,33 @@ def create_customer():
 @token_required
 def list_customers():
     role = request.user.get("role")
-    if role not in ["staff", "admin"]:
+    if role not in WRITE_ROLES:
         return jsonify({"error": "權限不足"}), 403
+
+    etag = _request_etag()
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+
     customers = read_customers() or []
-    return jsonify(customers)
+    return _cacheable(jsonify(customers), etag)
 
 @app.route("/api/customers/<account>", methods=["PUT"])
 @token_required
 def edit_customer(account):
-    if request.user.get("role") not in ["admin", "staff"]:
+    if request.user.get("role") not in WRITE_ROLES:
         return jsonify({"error": "只有管理員與作業人員可以修改客戶資料"}), 403
     data = request.get_json() or {}
     update_customer(account, data)
     return jsonify({"message": "客戶資料已更新"})
 
+def _to_float(value):
+    """轉成數字，格式不對回傳 None (取代各處重複的 try/except)"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
 # ------------------------------------------------
 # 建立包裹 (含重量體積後端檢查)
 # ------------------------------------------------
@@ -202,34 +309,25 @@ def create_parcel():
     service_type = data.get("service_type") or "標準速遞"
 
     # 後端防呆：檢查重量
-    try:
-        w_val = float(weight)
-        if w_val <= 0:
-            return jsonify({"error": "重量必須大於 0"}), 400
-    except (TypeError, ValueError):
+    w_val = _to_float(weight)
+    if w_val is None:
         return jsonify({"error": "重量格式錯誤"}), 400
+    if w_val <= 0:
+        return jsonify({"error": "重量必須大於 0"}), 400
 
-    # 後端防呆：檢查體積 (若是純數字字串)
-    if volume:
-        try:
-            v_val = float(volume)
-            if v_val < 0:
-                return jsonify({"error": "體積不能為負數"}), 400
-        except ValueError:
-            pass
+    # 後端防呆：檢查體積 (若是純數字字串；"20×20×20" 這類寫法照原樣接受)
+    v_val = _to_float(volume) if volume else None
+    if v_val is not None and v_val < 0:
+        return jsonify({"error": "體積不能為負數"}), 400
 
     if not sender_id or not recipient_name:
         return jsonify({"error": "缺少寄件人或收件人"}), 400
 
-    today = datetime.now().strftime("%Y%m%d")
-    rand4 = str(datetime.now().microsecond)[-4:]
-    tracking_number = f"TRK-{today}-{rand4}"
     # ✅ 修改：不需要手動轉字串，資料庫會自動處理
     # created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     created_at = datetime.now()  # 直接傳入 datetime 物件
 
     record = {
-        "tracking_number": tracking_number,
         "sender_id": sender_id,
         "recipient_name": recipient_name,
         "recipient_address": recipient_address,
@@ -243,27 +341,32 @@ def create_parcel():
         "created_at": created_at,
     }
 
-    append_parcel(record)
-    
-    # 記錄事件
-    event_id = f"EVT-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
-    append_tracking_event({
-        "event_id": event_id,
-        "tracking_number": tracking_number,
-        "event_type": "建立包裹",
-        "timestamp": created_at,  # ✅ 修改：直接傳入 datetime
-        "location": "系統",
-        "operator": request.user.get("username"),
-        "description": f"包裹由 {sender_id} 建立"
-    })
+    # 包裹與建立事件一起寫入 (同一筆交易)
+    # 隨機碼 8 個 hex (每天約 43 億種)；真的撞號就換一個重試，其他錯誤照常往上丟
+    for _ in range(TRACKING_NUMBER_RETRIES):
+        tracking_number = f"TRK-{created_at:%Y%m%d}-{secrets.token_hex(4)}"
+        record["tracking_number"] = tracking_number
+        try:
+            append_parcel_with_event(record, {
+                "event_id": f"EVT-{uuid.uuid4().hex}",
+                "tracking_number": tracking_number,
+                "event_type": "建立包裹",
+                "timestamp": created_at,  # ✅ 修改：直接傳入 datetime
+                "location": "系統",
+                "operator": request.user.get("username"),
+                "description": f"包裹由 {sender_id} 建立"
+            })
+            break
+        except IntegrityError:
+            if get_parcel_status(tracking_number) is None:
+                raise
+    else:
+        return jsonify({"error": "無法產生追蹤編號，請稍後再試"}), 503
 
     return jsonify({
         "message": "包裹建立成功",
         "tracking_no": tracking_number,
-        "package": {
-            **record,
-            "created_at": created_at.strftime("%Y-%m-%d %H:%M:%S")  # 回傳給前端時格式化
-        },
+        "package": record,  # created_at 由 OrjsonProvider 格式化
     }), 201
 
 # ------------------------------------------------
@@ -282,23 +385,20 @@ def set_parcel_amount():
     if amount is None:
         return jsonify({"error": "缺少金額"}), 400
 
-    try:
-        amount_val = float(amount)
-        if amount_val < 0:
-             return jsonify({"error": "金額不能為負數"}), 400
-    except (TypeError, ValueError):
+    amount_val = _to_float(amount)
+    if amount_val is None:
         return jsonify({"error": "金額格式錯誤"}), 400
+    if amount_val < 0:
+        return jsonify({"error": "金額不能為負數"}), 400
 
     payment_status_text = "已付款(線上)"
-    if pay_method in ["cash", "cod"]:
+    if pay_method in COD_METHODS:
         payment_status_text = "待付款(貨到付款)"
     elif pay_method == "monthly":
         payment_status_text = "月結帳單"
 
-    update_parcel_amount(tracking, amount_val)
-
-    event_id = f"EVT-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
-    append_tracking_event({
+    event_id = f"EVT-{uuid.uuid4().hex}"
+    update_parcel_amount_with_event(tracking, amount_val, {
         "event_id": event_id,
         "tracking_number": tracking,
         "event_type": "計費完成",
@@ -337,34 +437,25 @@ def set_parcel_status():
     if not tracking or not new_status:
         return jsonify({"error": "資料不全"}), 400
 
-    parcels = read_parcels()
-    current_parcel = next((p for p in parcels if p["tracking_number"] == tracking), None)
-    if not current_parcel:
-        return jsonify({"error": "找不到該追蹤編號"}), 404
-
-    current_status = current_parcel.get("status", "")
-    ABNORMAL_STATUSES = ["遺失", "損毀", "退回"]
-    
-    if current_status in ABNORMAL_STATUSES and new_status not in ["處理中", "退回"]:
-        if role != "admin":
-             return jsonify({"error": f"包裹處於 '{current_status}' 狀態,無法進行一般更新"}), 400
-
+    # 角色權限只看要改成的狀態，先檢查完再查資料庫
     if role == "driver":
-        allowed = ["已裝車", "配送中", "已送達", "延誤", "遺失", "損毀"]
-        if new_status not in allowed:
+        if new_status not in DRIVER_ALLOWED:
             return jsonify({"error": "司機無法執行此狀態變更"}), 403
             
     if role == "warehouse":
-        allowed = ["已收件", "進入倉儲", "已裝車", "退回", "損毀"]
-        if new_status not in allowed:
+        if new_status not in WAREHOUSE_ALLOWED:
             return jsonify({"error": "倉儲人員無法執行此狀態變更"}), 403
 
-    ok = update_parcel_status(tracking, new_status)
-    if not ok:
-        return jsonify({"error": "更新失敗"}), 404
+    current_status = get_parcel_status(tracking)
+    if current_status is None:
+        return jsonify({"error": "找不到該追蹤編號"}), 404
 
-    event_id = f"EVT-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
-    append_tracking_event({
+    if current_status in ABNORMAL and new_status not in ABNORMAL_EXIT:
+        if role != "admin":
+             return jsonify({"error": f"包裹處於 '{current_status}' 狀態,無法進行一般更新"}), 400
+
+    event_id = f"EVT-{uuid.uuid4().hex}"
+    ok = update_parcel_status_with_event(tracking, new_status, {
         "event_id": event_id,
         "tracking_number": tracking,
         "event_type": new_status,
@@ -375,6 +466,8 @@ def set_parcel_status():
         "operator": request.user.get("username"),
         "description": description or f"狀態變更為: {new_status}"
     })
+    if not ok:
+        return jsonify({"error": "更新失敗"}), 404
 
     return jsonify({"message": "狀態已更新", "status": new_status})
 
@@ -385,7 +478,7 @@ def set_parcel_status():
 @token_required
 def delete_parcel(tracking_no):
     role = request.user.get("role")
-    if role not in ["admin", "staff"]:
+    if role not in WRITE_ROLES:
         return jsonify({"error": "權限不足，無法刪除"}), 403
 
     success = delete_parcel_by_tracking(tracking_no)
@@ -400,10 +493,15 @@ def delete_parcel(tracking_no):
 @app.route("/api/parcels/<tracking_no>/history", methods=["GET"])
 @token_required
 def get_parcel_history(tracking_no):
+    etag = _request_etag()
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+
     events = read_tracking_events(tracking_no)
     if not events:
-        return jsonify({"message": "查無追蹤紀錄", "events": []}), 200
-    return jsonify({"tracking_number": tracking_no, "events": events})
+        return _cacheable(jsonify({"message": "查無追蹤紀錄", "events": []}), etag)
+    return _cacheable(jsonify({"tracking_number": tracking_no, "events": events}), etag)
 
 @app.route("/records", methods=["GET"])
 @token_required
@@ -414,66 +512,46 @@ def list_records():
     vehicle_filter = request.args.get("vehicle_id")
     warehouse_filter = request.args.get("warehouse_id")
 
-    parcels = read_parcels() or []
+    etag = _request_etag()
+    cached = _not_modified(etag)
+    if cached:
+        return cached
 
-    if role == "customer":
-        parcels = [p for p in parcels if p.get("sender_id") == username]
-    
-    allowed_tracking_nums = None
-    if vehicle_filter or warehouse_filter:
-        all_events = read_all_events_for_search()
-        allowed_tracking_nums = set()
-        for e in all_events:
-            if vehicle_filter and vehicle_filter.lower() in str(e.get("vehicle_id") or "").lower():
-                allowed_tracking_nums.add(e["tracking_number"])
-            if warehouse_filter and warehouse_filter.lower() in str(e.get("warehouse_id") or "").lower():
-                allowed_tracking_nums.add(e["tracking_number"])
-    
-    rows = []
-    for p in parcels:
-        if allowed_tracking_nums is not None:
-            if p.get("tracking_number") not in allowed_tracking_nums:
-                continue
-        created_at = p.get("created_at") or ""
-        date_only = created_at.split(" ")[0] if created_at else ""
-        rows.append({
-            "tracking_no": p.get("tracking_number"),
-            "sender_id": p.get("sender_id"),
-            "receiver_name": p.get("recipient_name"),
-            "weight": p.get("weight"),
-            "package_type": p.get("package_type", ""),
-            "date": date_only,
-            "amount": p.get("amount"),
-            "status": p.get("status"),
-        })
-    return jsonify(rows)
+    rows = read_records_rows(
+        sender_id=username if role == "customer" else None,
+        vehicle_like=vehicle_filter,
+        warehouse_like=warehouse_filter,
+    )
+    return _cacheable(jsonify(rows), etag)
+
+# ------------------------------------------------
+# CSV 匯出檔：資料有變更才重建，下載時直接送檔案
+# 用資料庫檔案的指紋判斷是否過期，多個 worker 寫入也不會拿到舊檔
+# ------------------------------------------------
+EXPORT_FILE = os.path.abspath(os.path.join("exports", "logistics_export.csv"))
+
+_export_lock = threading.Lock()
+_export_fingerprint = None
+
+
+def _write_csv_export(path):
+    """逐列寫入暫存檔再換上去，下載中的舊檔不會被寫到一半"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+
+    # utf-8-sig 加入 BOM 讓 Excel 正確顯示中文
+    with open(tmp, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
 
-# ✅ 修改：改為匯出 CSV（因為不再使用 Excel）
-@app.route("/api/download", methods=["GET"])
-@token_required
-def download_csv():
-    role = request.user.get("role")
-    if role == "customer":
-        return jsonify({"error": "權限不足"}), 403
-    
-    try:
-        # 讀取資料
-        parcels = read_parcels()
-        customers = read_customers()
-        
-        # 建立 CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
         # 寫入標題
         writer.writerow([
             '追蹤編號', '寄件人', '收件人', '收件地址', '重量', 
             '包裹類型', '申報價值', '內容物', '服務類型', 
             '狀態', '金額', '建立時間'
         ])
-        
+
         # 寫入資料
-        for p in parcels:
+        for p in iter_parcels():
             writer.writerow([
                 p.get('tracking_number', ''),
                 p.get('sender_id', ''),
@@ -488,24 +566,48 @@ def download_csv():
                 p.get('amount', ''),
                 p.get('created_at', '')
             ])
-        
-        # 轉換為 bytes
-        output.seek(0)
-        
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8-sig')),  # 加入 BOM 讓 Excel 正確顯示中文
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name='logistics_export.csv'
-        )
-        
+
+    os.replace(tmp, path)
+
+
+def _ensure_csv_export():
+    global _export_fingerprint
+    with _export_lock:
+        # 先取指紋再匯出：匯出途中有新的寫入，下次下載就會重建
+        fingerprint = data_fingerprint()
+        if fingerprint != _export_fingerprint or not os.path.exists(EXPORT_FILE):
+            _write_csv_export(EXPORT_FILE)
+            _export_fingerprint = fingerprint
+    return EXPORT_FILE
+
+
+# ✅ 修改：改為匯出 CSV（因為不再使用 Excel）
+@app.route("/api/download", methods=["GET"])
+@token_required
+def download_csv():
+    role = request.user.get("role")
+    if role == "customer":
+        return jsonify({"error": "權限不足"}), 403
+    
+    try:
+        path = _ensure_csv_export()
     except Exception as e:
         print(f"匯出失敗: {e}")
         return jsonify({"error": "匯出失敗"}), 500
 
+    # conditional=True：支援 If-Modified-Since / Range，檔案內容由 sendfile 直接送出
+    return send_file(
+        path,
+        mimetype='text/csv',
+        as_attachment=True,
+        download_name='logistics_export.csv',
+        conditional=True
+    )
+
 # ✅ 修改：使用資料庫初始化
 initialize_database()
 init_default_accounts()
 
+# 正式環境用 gunicorn 啟動 (見 wsgi.py / gunicorn.conf.py)，這裡只給本機開發用
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=os.environ.get("FLASK_ENV") == "development")
\ No newline at end of file
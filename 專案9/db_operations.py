@@ -1,11 +1,28 @@
 from models import (
-    SessionLocal, Account, Customer, Parcel, TrackingEvent, init_database
+    engine, SessionLocal, Account, Customer, Parcel, TrackingEvent, init_database
 )
+from sqlalchemy import String, func, or_
 from datetime import datetime
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 # ================================================
 # 帳號管理
 # ================================================
+# 帳號快取：短時間內重複登入 / 註冊檢查不必每次查資料庫，新增帳號時清掉該帳號
+# 限制：快取在每個 worker 行程各自一份，只有本行程的 append_account 會清掉；
+# 其他 worker (或外部程式) 改了密碼、角色或刪掉帳號，這裡最多還會沿用 TTL 秒的舊資料，
+# 所以 TTL 只留幾秒，只吸收同一時間的重複查詢
+ACCOUNT_CACHE_TTL = 5  # 秒
+
+_account_cache = {}
+_account_cache_lock = threading.Lock()
+
+
 def append_account(account_data):
     """新增帳號"""
     db = SessionLocal()
@@ -22,39 +39,35 @@ def append_account(account_data):
         print(f"新增帳號失敗: {e}")
     finally:
         db.close()
+        with _account_cache_lock:
+            _account_cache.pop(account_data.get("username"), None)
 
 
 def find_account(username):
-    """查詢單一帳號"""
+    """查詢單一帳號 (先查快取，沒有才用主鍵查資料庫)"""
+    now = time.time()
+    with _account_cache_lock:
+        cached = _account_cache.get(username)
+    if cached and cached[1] > now:
+        return cached[0]
+
     db = SessionLocal()
     try:
         account = db.query(Account).filter(Account.username == username).first()
-        if account:
-            return {
-                "username": account.username,
-                "password": account.password,
-                "role": account.role,
-                "created_at": account.created_at.strftime("%Y-%m-%d %H:%M:%S") if account.created_at else ""
-            }
-        return None
+        if not account:
+            return None  # 查不到的不快取，註冊後馬上就能登入
+        result = {
+            "username": account.username,
+            "password": account.password,
+            "role": account.role,
+            "created_at": account.created_at.strftime("%Y-%m-%d %H:%M:%S") if account.created_at else ""
+        }
     finally:
         db.close()
 
-
-def read_accounts():
-    """讀取所有帳號"""
-    db = SessionLocal()
-    try:
-        accounts = {}
-        for account in db.query(Account).all():
-            accounts[account.username] = {
-                "password": account.password,
-                "role": account.role,
-                "created_at": account.created_at.strftime("%Y-%m-%d %H:%M:%S") if account.created_at else ""
-            }
-        return accounts
-    finally:
-        db.close()
+    with _account_cache_lock:
+        _account_cache[username] = (result, now + ACCOUNT_CACHE_TTL)
+    return result
 
 
 # ================================================
@@ -126,88 +139,160 @@ def update_customer(account, data):
 # ================================================
 # 包裹管理
 # ================================================
-def append_parcel(record):
-    """新增包裹"""
+def _new_parcel(record):
+    return Parcel(
+        tracking_number=record.get("tracking_number"),
+        sender_id=record.get("sender_id"),
+        recipient_name=record.get("recipient_name"),
+        recipient_address=record.get("recipient_address"),
+        weight=record.get("weight"),
+        package_type=record.get("package_type", "中型箱"),
+        declared_value=record.get("declared_value", 0),
+        contents=record.get("contents", "一般貨物"),
+        service_type=record.get("service_type"),
+        status=record.get("status", "建立包裹"),
+        amount=record.get("amount"),
+        payment_status=record.get("payment_status", "Unpaid")
+    )
+
+
+def append_parcel_with_event(record, event):
+    """
+    新增包裹並記錄建立事件 (同一筆交易，只 commit 一次)
+    失敗時 rollback 後把例外往上丟，追蹤編號撞號 (IntegrityError) 由呼叫端重試
+    """
     db = SessionLocal()
     try:
-        parcel = Parcel(
-            tracking_number=record.get("tracking_number"),
-            sender_id=record.get("sender_id"),
-            recipient_name=record.get("recipient_name"),
-            recipient_address=record.get("recipient_address"),
-            weight=record.get("weight"),
-            package_type=record.get("package_type", "中型箱"),
-            declared_value=record.get("declared_value", 0),
-            contents=record.get("contents", "一般貨物"),
-            service_type=record.get("service_type"),
-            status=record.get("status", "建立包裹"),
-            amount=record.get("amount"),
-            payment_status=record.get("payment_status", "Unpaid")
-        )
-        db.add(parcel)
+        db.add(_new_parcel(record))
+        db.add(_new_tracking_event(event))
         db.commit()
-    except Exception as e:
+    except Exception:
         db.rollback()
-        print(f"新增包裹失敗: {e}")
+        logger.exception("新增包裹失敗: %s", record.get("tracking_number"))
+        raise
+    finally:
+        db.close()
+
+
+def _parcel_to_dict(p):
+    return {
+        "tracking_number": p.tracking_number,
+        "sender_id": p.sender_id,
+        "recipient_name": p.recipient_name,
+        "recipient_address": p.recipient_address,
+        "weight": p.weight,
+        "package_type": p.package_type,
+        "declared_value": p.declared_value,
+        "contents": p.contents,
+        "service_type": p.service_type,
+        "status": p.status,
+        "amount": p.amount,
+        "payment_status": p.payment_status,
+        "created_at": p.created_at.strftime("%Y-%m-%d %H:%M:%S") if p.created_at else ""
+    }
+
+
+def iter_parcels(batch_size=500):
+    """逐筆讀取所有包裹 (每次只向資料庫取一批，不會一次載入整張表)"""
+    db = SessionLocal()
+    try:
+        for p in db.query(Parcel).yield_per(batch_size):
+            yield _parcel_to_dict(p)
     finally:
         db.close()
 
 
-def read_parcels():
-    """讀取所有包裹"""
+def _like_pattern(keyword):
+    """部分比對用的 LIKE 樣式 (跳脫 % 與 _，行為同 Python 的 in)"""
+    escaped = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def read_records_rows(sender_id=None, vehicle_like=None, warehouse_like=None):
+    """
+    /records 查詢：寄件人 / 車輛 / 倉儲的篩選一次在 SQL 裡完成
+    車輛與倉儲為不分大小寫的部分比對，包裹有任一事件符合其中一個條件即列入
+    欄位直接用 API 回傳的名稱 (AS 別名)，取出後不必再轉換
+    """
     db = SessionLocal()
     try:
-        parcels = []
-        for p in db.query(Parcel).all():
-            parcels.append({
-                "tracking_number": p.tracking_number,
-                "sender_id": p.sender_id,
-                "recipient_name": p.recipient_name,
-                "recipient_address": p.recipient_address,
-                "weight": p.weight,
-                "package_type": p.package_type,
-                "declared_value": p.declared_value,
-                "contents": p.contents,
-                "service_type": p.service_type,
-                "status": p.status,
-                "amount": p.amount,
-                "payment_status": p.payment_status,
-                "created_at": p.created_at.strftime("%Y-%m-%d %H:%M:%S") if p.created_at else ""
-            })
-        return parcels
+        query = db.query(
+            Parcel.tracking_number.label("tracking_no"),
+            Parcel.sender_id,
+            Parcel.recipient_name.label("receiver_name"),
+            Parcel.weight,
+            Parcel.package_type,
+            func.coalesce(func.substr(Parcel.created_at, 1, 10), "", type_=String).label("date"),
+            Parcel.amount,
+            Parcel.status,
+        )
+        if sender_id is not None:
+            query = query.filter(Parcel.sender_id == sender_id)
+
+        conditions = []
+        if vehicle_like:
+            conditions.append(TrackingEvent.vehicle_id.ilike(_like_pattern(vehicle_like), escape="\\"))
+        if warehouse_like:
+            conditions.append(TrackingEvent.warehouse_id.ilike(_like_pattern(warehouse_like), escape="\\"))
+        if conditions:
+            matched = db.query(TrackingEvent.tracking_number).filter(
+                TrackingEvent.tracking_number == Parcel.tracking_number,
+                or_(*conditions),
+            ).exists()
+            query = query.filter(matched)
+
+        return [dict(r._mapping) for r in query.all()]
+    finally:
+        db.close()
+
+
+def get_parcel_status(tracking_number):
+    """查詢單一包裹目前的狀態 (走主鍵索引，找不到回傳 None)"""
+    db = SessionLocal()
+    try:
+        row = db.query(Parcel.status).filter(Parcel.tracking_number == tracking_number).first()
+        if row is None:
+            return None
+        return row.status or ""
     finally:
         db.close()
 
 
-def update_parcel_amount(tracking_number, amount):
-    """更新包裹金額"""
+def update_parcel_amount_with_event(tracking_number, amount, event):
+    """更新包裹金額並記錄計費事件 (同一筆交易)，失敗時 rollback 後往上丟"""
     db = SessionLocal()
     try:
         parcel = db.query(Parcel).filter(Parcel.tracking_number == tracking_number).first()
         if parcel:
             parcel.amount = amount
-            db.commit()
-    except Exception as e:
+        db.add(_new_tracking_event(event))
+        db.commit()
+    except Exception:
         db.rollback()
-        print(f"更新金額失敗: {e}")
+        logger.exception("更新金額失敗: %s", tracking_number)
+        raise
     finally:
         db.close()
 
 
-def update_parcel_status(tracking_number, status):
-    """更新包裹狀態"""
+def update_parcel_status_with_event(tracking_number, status, event):
+    """
+    更新包裹狀態並記錄事件 (同一筆交易)，找不到包裹回傳 False
+    其他錯誤 rollback 後往上丟，不再當成「找不到」
+    """
     db = SessionLocal()
     try:
         parcel = db.query(Parcel).filter(Parcel.tracking_number == tracking_number).first()
-        if parcel:
-            parcel.status = status
-            db.commit()
-            return True
-        return False
-    except Exception as e:
+        if not parcel:
+            return False
+        parcel.status = status
+        db.add(_new_tracking_event(event))
+        db.commit()
+        return True
+    except Exception:
         db.rollback()
-        print(f"更新狀態失敗: {e}")
-        return False
+        logger.exception("更新狀態失敗: %s", tracking_number)
+        raise
     finally:
         db.close()
 
@@ -233,28 +318,18 @@ def delete_parcel_by_tracking(tracking_number):
 # ================================================
 # 物流事件追蹤
 # ================================================
-def append_tracking_event(event):
-    """新增追蹤事件"""
-    db = SessionLocal()
-    try:
-        tracking_event = TrackingEvent(
-            event_id=event.get("event_id"),
-            tracking_number=event.get("tracking_number"),
-            event_type=event.get("event_type"),
-            timestamp=datetime.strptime(event.get("timestamp"), "%Y-%m-%d %H:%M:%S") if isinstance(event.get("timestamp"), str) else event.get("timestamp"),
-            location=event.get("location", ""),
-            vehicle_id=event.get("vehicle_id", ""),
-            warehouse_id=event.get("warehouse_id", ""),
-            operator=event.get("operator", ""),
-            description=event.get("description", "")
-        )
-        db.add(tracking_event)
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        print(f"新增事件失敗: {e}")
-    finally:
-        db.close()
+def _new_tracking_event(event):
+    return TrackingEvent(
+        event_id=event.get("event_id"),
+        tracking_number=event.get("tracking_number"),
+        event_type=event.get("event_type"),
+        timestamp=datetime.strptime(event.get("timestamp"), "%Y-%m-%d %H:%M:%S") if isinstance(event.get("timestamp"), str) else event.get("timestamp"),
+        location=event.get("location", ""),
+        vehicle_id=event.get("vehicle_id", ""),
+        warehouse_id=event.get("warehouse_id", ""),
+        operator=event.get("operator", ""),
+        description=event.get("description", "")
+    )
 
 
 def read_tracking_events(tracking_number):
@@ -281,20 +356,23 @@ def read_tracking_events(tracking_number):
         db.close()
 
 
-def read_all_events_for_search():
-    """讀取所有事件 (用於搜尋)"""
-    db = SessionLocal()
-    try:
-        events = []
-        for e in db.query(TrackingEvent).all():
-            events.append({
-                "tracking_number": e.tracking_number,
-                "vehicle_id": e.vehicle_id,
-                "warehouse_id": e.warehouse_id
-            })
-        return events
-    finally:
-        db.close()
+# ================================================
+# 資料版本
+# ================================================
+def data_fingerprint():
+    """
+    資料庫目前的版本指紋 (主檔與 -wal 檔的修改時間與大小)
+    每次 commit 都會改到其中一個檔案，其他 worker 寫入的變更也看得出來
+    """
+    path = engine.url.database
+    result = []
+    for p in (path, path + "-wal"):
+        try:
+            st = os.stat(p)
+            result.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            result.append(None)
+    return tuple(result)
 
 
 # ================================================
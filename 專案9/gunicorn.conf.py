@@ -0,0 +1,28 @@
+import multiprocessing
+
+# 啟動方式：gunicorn -c gunicorn.conf.py wsgi:application
+bind = "0.0.0.0:5000"
+
+# 資料都在 SQLite，各 worker 的快取 (JWT / 帳號) 只是加速用，
+# 所以可以開多個 worker，每個 worker 再用執行緒處理並行請求
+workers = multiprocessing.cpu_count() * 2 + 1
+worker_class = "gthread"
+# sqlite3 執行查詢時會釋放 GIL，同一個 worker 裡的執行緒可以重疊等待資料庫，
+# 不需要改成 async 框架；CSV 下載這種長時間回應也只佔住一條執行緒
+threads = 4
+
+# 預先載入 app：建表、補索引、建立預設帳號只在 master 跑一次。
+# 不預先載入的話，每個 worker 都會同時跑一次初始化，
+# 多個行程一起 create_all / 新增帳號容易 "database is locked" 或重複建帳號。
+# 代價是 master 的連線池會被 fork 帶進 worker，SQLite 連線不能跨行程共用，
+# 所以 post_fork 時丟掉繼承來的連線，讓每個 worker 自己重新連
+preload_app = True
+
+
+def post_fork(server, worker):
+    from models import engine
+
+    # close=False：不去關 master 的連線，只讓這個 worker 的連線池重新開始
+    engine.dispose(close=False)
+
+timeout = 60
@@ -1,11 +1,23 @@
-from sqlalchemy import create_engine, Column, String, Float, Integer, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, Column, String, Float, Integer, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 
 # 建立資料庫引擎 (SQLite)
 DATABASE_URL = "sqlite:///logistics.db"
-engine = create_engine(DATABASE_URL, echo=False)
+# 連線池：每個 worker 保留 4 條連線重複使用 (尖峰最多 16 條)，不必每次查詢都重新連線；
+# 同一條連線上 SQLAlchemy 與 sqlite3 都會快取編譯好的 SQL
+engine = create_engine(DATABASE_URL, echo=False, pool_size=4, max_overflow=12)
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    """WAL 讓讀取不會被寫入卡住；synchronous=NORMAL 在 WAL 下仍安全且少很多 fsync"""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 
 Base = declarative_base()
 SessionLocal = sessionmaker(bind=engine)
@@ -75,6 +87,13 @@ class Parcel(Base):
 # ================================================
 class TrackingEvent(Base):
     __tablename__ = "tracking_events"
+    __table_args__ = (
+        # 追蹤歷史：依追蹤編號查、依時間排序，直接走這個索引不必另外排序
+        Index("ix_tracking_events_tracking_timestamp", "tracking_number", "timestamp"),
+        # /records 依車輛 / 倉儲篩選時，只需掃索引就能拿到追蹤編號
+        Index("ix_tracking_events_vehicle_tracking", "vehicle_id", "tracking_number"),
+        Index("ix_tracking_events_warehouse_tracking", "warehouse_id", "tracking_number"),
+    )
     
     event_id = Column(String(50), primary_key=True)
     tracking_number = Column(String(50), ForeignKey("parcels.tracking_number"), nullable=False)
@@ -96,6 +115,11 @@ class TrackingEvent(Base):
 def init_database():
     """建立所有資料表"""
     Base.metadata.create_all(engine)
+
+    # create_all 不會替已存在的資料表補索引，舊的 logistics.db 在這裡補上
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     print("✅ 資料庫初始化完成")
 
 
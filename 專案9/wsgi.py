@@ -0,0 +1,4 @@
+from app import app
+
+# gunicorn -c gunicorn.conf.py wsgi:application
+application = app
@@ -6,7 +6,7 @@ from datetime import datetime, timedelta
 import os
 import io
 import csv
-import openpyxl # ✅ 新增：用於產生 Excel
+import xlsxwriter # ✅ 用於產生 Excel (constant_memory 串流寫入)
 # ✅ 新增：匯入模型以供 Excel 下載使用
 from models import SessionLocal, Parcel, Customer, Account, TrackingEvent
 
@@ -24,7 +24,7 @@ from db_operations import (
     append_account,
     read_accounts,
     find_account,
-    read_all_events_for_search,
+    search_parcels,
     delete_parcel_by_tracking,
 )
 
@@ -450,26 +450,15 @@ def list_records():
     vehicle_filter = request.args.get("vehicle_id")
     warehouse_filter = request.args.get("warehouse_id")
 
-    parcels = read_parcels() or []
-
-    if role == "customer":
-        parcels = [p for p in parcels if p.get("sender_id") == username]
-    
-    allowed_tracking_nums = None
-    if vehicle_filter or warehouse_filter:
-        all_events = read_all_events_for_search()
-        allowed_tracking_nums = set()
-        for e in all_events:
-            if vehicle_filter and vehicle_filter.lower() in str(e.get("vehicle_id") or "").lower():
-                allowed_tracking_nums.add(e["tracking_number"])
-            if warehouse_filter and warehouse_filter.lower() in str(e.get("warehouse_id") or "").lower():
-                allowed_tracking_nums.add(e["tracking_number"])
+    # 客戶只能看自己的包裹；車輛 / 倉儲條件交給資料庫一次篩選
+    parcels = search_parcels(
+        sender_id=username if role == "customer" else None,
+        vehicle_id=vehicle_filter,
+        warehouse_id=warehouse_filter,
+    )
     
     rows = []
     for p in parcels:
-        if allowed_tracking_nums is not None:
-            if p.get("tracking_number") not in allowed_tracking_nums:
-                continue
         created_at = p.get("created_at") or ""
         date_only = created_at.split(" ")[0] if created_at else ""
         rows.append({
@@ -488,6 +477,13 @@ def list_records():
 # ------------------------------------------------
 # ✅ 終極版 Excel 下載：日誌 + 包裹 + 客戶 + 帳號
 # ------------------------------------------------
+def _write_row(ws, row, values):
+    """xlsxwriter 寫入失敗時 write_row 回傳非 0 並略過該列剩下的欄位，這裡直接報錯，不交出缺資料的檔案"""
+    rc = ws.write_row(row, 0, values)
+    if rc != 0:
+        raise ValueError(f"{ws.name} 第 {row + 1} 列無法寫入 (xlsxwriter 回傳 {rc})")
+
+
 @app.route("/api/download", methods=["GET"])
 @token_required
 def download_excel():
@@ -497,17 +493,29 @@ def download_excel():
     
     db = SessionLocal()
     try:
-        wb = openpyxl.Workbook()
+        # constant_memory：每寫完一列就落地到暫存檔，不會把整本活頁簿留在記憶體
+        output = io.BytesIO()
+        # 資料一律照原樣輸出：字串不自動轉成網址 / 公式 / 數字
+        wb = xlsxwriter.Workbook(output, {
+            "constant_memory": True,
+            "strings_to_urls": False,
+            "strings_to_formulas": False,
+            "strings_to_numbers": False,
+        })
         
         # 分頁 1: 物流日誌 (TrackingEvent) - 這是您最想要的日誌
-        ws_log = wb.active
-        ws_log.title = "物流日誌(操作紀錄)"
-        ws_log.append(['發生時間', '操作人員', '事件類型', '追蹤編號', '地點', '車輛/倉儲', '備註', '寄件人'])
+        ws_log = wb.add_worksheet("物流日誌(操作紀錄)")
+        _write_row(ws_log, 0, ['發生時間', '操作人員', '事件類型', '追蹤編號', '地點', '車輛/倉儲', '備註', '寄件人'])
         
-        events = db.query(TrackingEvent).order_by(TrackingEvent.timestamp.desc()).all()
-        for e in events:
-            sender_id = e.parcel.sender_id if e.parcel else "(包裹已刪除)"
-            ws_log.append([
+        # 一次 JOIN 取回寄件人，不再每筆事件各查一次 e.parcel
+        events = (
+            db.query(TrackingEvent, Parcel.sender_id)
+            .outerjoin(Parcel, Parcel.tracking_number == TrackingEvent.tracking_number)
+            .order_by(TrackingEvent.timestamp.desc())
+            .yield_per(1000)
+        )
+        for i, (e, sender_id) in enumerate(events, start=1):
+            _write_row(ws_log, i, [
                 e.timestamp.strftime("%Y-%m-%d %H:%M:%S") if e.timestamp else "",
                 e.operator or "系統自動",
                 e.event_type,
@@ -515,19 +523,18 @@ def download_excel():
                 e.location,
                 f"{e.vehicle_id or ''} {e.warehouse_id or ''}".strip(),
                 e.description,
-                sender_id
+                sender_id if sender_id is not None else "(包裹已刪除)"
             ])
 
         # 分頁 2: 包裹清單 (Parcel)
-        ws_parcel = wb.create_sheet("包裹清單")
-        ws_parcel.append([
+        ws_parcel = wb.add_worksheet("包裹清單")
+        _write_row(ws_parcel, 0, [
             '追蹤編號', '寄件人', '收件人', '收件地址', '重量', 
             '包裹類型', '申報價值', '內容物', '服務類型', 
             '狀態', '金額', '付款狀態', '建立時間'
         ])
-        parcels = db.query(Parcel).all()
-        for p in parcels:
-            ws_parcel.append([
+        for i, p in enumerate(db.query(Parcel).yield_per(1000), start=1):
+            _write_row(ws_parcel, i, [
                 p.tracking_number, p.sender_id, p.recipient_name, p.recipient_address,
                 p.weight, p.package_type, p.declared_value, p.contents, p.service_type,
                 p.status, p.amount, p.payment_status,
@@ -535,26 +542,23 @@ def download_excel():
             ])
 
         # 分頁 3: 客戶資料 (Customer)
-        ws_cust = wb.create_sheet("客戶資料")
-        ws_cust.append(['帳號', '姓名', '電話', 'Email', '地址', '客戶類型', '帳單偏好'])
-        customers = db.query(Customer).all()
-        for c in customers:
-            ws_cust.append([
+        ws_cust = wb.add_worksheet("客戶資料")
+        _write_row(ws_cust, 0, ['帳號', '姓名', '電話', 'Email', '地址', '客戶類型', '帳單偏好'])
+        for i, c in enumerate(db.query(Customer).yield_per(1000), start=1):
+            _write_row(ws_cust, i, [
                 c.account, c.name, c.phone, c.email, c.address, c.customer_type, c.billing_preference
             ])
 
         # 分頁 4: 系統帳號 (Account)
-        ws_acc = wb.create_sheet("系統帳號")
-        ws_acc.append(['帳號', '角色', '建立時間'])
-        accounts = db.query(Account).all()
-        for a in accounts:
-            ws_acc.append([
+        ws_acc = wb.add_worksheet("系統帳號")
+        _write_row(ws_acc, 0, ['帳號', '角色', '建立時間'])
+        for i, a in enumerate(db.query(Account).yield_per(1000), start=1):
+            _write_row(ws_acc, i, [
                 a.username, a.role, 
                 a.created_at.strftime("%Y-%m-%d %H:%M:%S") if a.created_at else ""
             ])
 
-        output = io.BytesIO()
-        wb.save(output)
+        wb.close()
         output.seek(0)
         
         return send_file(
@@ -1,6 +1,7 @@
 from models import (
     SessionLocal, Account, Customer, Parcel, TrackingEvent, init_database
 )
+from sqlalchemy import or_
 from datetime import datetime
 
 # ================================================
@@ -153,28 +154,60 @@ def append_parcel(record):
         db.close()
 
 
+def _parcel_to_dict(p):
+    return {
+        "tracking_number": p.tracking_number,
+        "sender_id": p.sender_id,
+        "recipient_name": p.recipient_name,
+        "recipient_address": p.recipient_address,
+        "weight": p.weight,
+        "package_type": p.package_type,
+        "declared_value": p.declared_value,
+        "contents": p.contents,
+        "service_type": p.service_type,
+        "status": p.status,
+        "amount": p.amount,
+        "payment_status": p.payment_status,
+        "created_at": p.created_at.strftime("%Y-%m-%d %H:%M:%S") if p.created_at else ""
+    }
+
+
 def read_parcels():
     """讀取所有包裹"""
     db = SessionLocal()
     try:
-        parcels = []
-        for p in db.query(Parcel).all():
-            parcels.append({
-                "tracking_number": p.tracking_number,
-                "sender_id": p.sender_id,
-                "recipient_name": p.recipient_name,
-                "recipient_address": p.recipient_address,
-                "weight": p.weight,
-                "package_type": p.package_type,
-                "declared_value": p.declared_value,
-                "contents": p.contents,
-                "service_type": p.service_type,
-                "status": p.status,
-                "amount": p.amount,
-                "payment_status": p.payment_status,
-                "created_at": p.created_at.strftime("%Y-%m-%d %H:%M:%S") if p.created_at else ""
-            })
-        return parcels
+        return [_parcel_to_dict(p) for p in db.query(Parcel).all()]
+    finally:
+        db.close()
+
+
+def _like_pattern(keyword):
+    """部分比對用的 LIKE 樣式 (跳脫 % 與 _，行為同 Python 的 in)"""
+    escaped = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def search_parcels(sender_id=None, vehicle_id=None, warehouse_id=None):
+    """
+    進階查詢：一次 SQL 完成寄件人 / 車輛 / 倉儲的篩選
+    車輛與倉儲為不分大小寫的部分比對，任一事件符合其中一個條件即列入
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(Parcel)
+        if sender_id is not None:
+            query = query.filter(Parcel.sender_id == sender_id)
+
+        conditions = []
+        if vehicle_id:
+            conditions.append(TrackingEvent.vehicle_id.ilike(_like_pattern(vehicle_id), escape="\\"))
+        if warehouse_id:
+            conditions.append(TrackingEvent.warehouse_id.ilike(_like_pattern(warehouse_id), escape="\\"))
+        if conditions:
+            matched = db.query(TrackingEvent.tracking_number).filter(or_(*conditions))
+            query = query.filter(Parcel.tracking_number.in_(matched))
+
+        return [_parcel_to_dict(p) for p in query.all()]
     finally:
         db.close()
 
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, String, Float, Integer, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, Column, String, Float, Integer, DateTime, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -7,6 +7,16 @@ from datetime import datetime
 DATABASE_URL = "sqlite:///logistics.db"
 engine = create_engine(DATABASE_URL, echo=False)
 
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    """WAL 讓讀取不會被寫入卡住；synchronous=NORMAL 在 WAL 下仍安全且少很多 fsync"""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 Base = declarative_base()
 SessionLocal = sessionmaker(bind=engine)
 
@@ -52,7 +62,7 @@ class Parcel(Base):
     __tablename__ = "parcels"
     
     tracking_number = Column(String(50), primary_key=True)
-    sender_id = Column(String(50), ForeignKey("accounts.username"), nullable=False)
+    sender_id = Column(String(50), ForeignKey("accounts.username"), nullable=False, index=True)
     recipient_name = Column(String(100), nullable=False)
     recipient_address = Column(String(255))
     weight = Column(Float)
@@ -77,7 +87,7 @@ class TrackingEvent(Base):
     __tablename__ = "tracking_events"
     
     event_id = Column(String(50), primary_key=True)
-    tracking_number = Column(String(50), ForeignKey("parcels.tracking_number"), nullable=False)
+    tracking_number = Column(String(50), ForeignKey("parcels.tracking_number"), nullable=False, index=True)
     event_type = Column(String(50), nullable=False)
     timestamp = Column(DateTime, default=datetime.now)
     location = Column(String(100))
@@ -96,6 +106,11 @@ class TrackingEvent(Base):
 def init_database():
     """建立所有資料表"""
     Base.metadata.create_all(engine)
+
+    # create_all 不會替已存在的資料表補索引，舊的 logistics.db 在這裡補上
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     print("✅ 資料庫初始化完成")
 
 
@@ -1038,6 +1038,23 @@ class TestSearchAndQuery:
             headers={'Authorization': f'Bearer {warehouse_token}'}
         )
         assert response.status_code == 200
+    
+    def test_search_partial_and_case_insensitive(self, client, admin_token, warehouse_token, test_parcel):
+        """測試車輛 / 倉儲為不分大小寫的部分比對，且 % 不會被當成萬用字元"""
+        client.post('/api/parcels/status',
+            headers={'Authorization': f'Bearer {warehouse_token}'},
+            json={"tracking_number": test_parcel, "status": "已裝車", "vehicle_id": "VEH-SRCH-77"}
+        )
+        headers = {'Authorization': f'Bearer {admin_token}'}
+        
+        data = json.loads(client.get('/records?vehicle_id=srch-7', headers=headers).data)
+        assert test_parcel in [r['tracking_no'] for r in data]
+        
+        data = json.loads(client.get('/records?vehicle_id=%25', headers=headers).data)
+        assert test_parcel not in [r['tracking_no'] for r in data]
+        
+        data = json.loads(client.get('/records?vehicle_id=nope&warehouse_id=nope', headers=headers).data)
+        assert test_parcel not in [r['tracking_no'] for r in data]
 
 
 # ========================================
@@ -1122,6 +1139,48 @@ class TestExcelDownload:
         assert response.status_code == 200
         assert 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' in response.content_type
     
+    def test_download_contents(self, client, admin_token, test_parcel):
+        """測試下載內容包含四個分頁，且日誌帶出寄件人"""
+        import openpyxl
+        response = client.get('/api/download',
+            headers={'Authorization': f'Bearer {admin_token}'}
+        )
+        assert response.status_code == 200
+        wb = openpyxl.load_workbook(io.BytesIO(response.data), read_only=True)
+        assert wb.sheetnames == ["物流日誌(操作紀錄)", "包裹清單", "客戶資料", "系統帳號"]
+        log_rows = [r for r in wb["物流日誌(操作紀錄)"].iter_rows(min_row=2, values_only=True) if r[3] == test_parcel]
+        assert log_rows and log_rows[0][7] == "admin1"
+        parcel_ids = [r[0] for r in wb["包裹清單"].iter_rows(min_row=2, values_only=True)]
+        assert test_parcel in parcel_ids
+        wb.close()
+
+    def test_download_keeps_text_as_is(self, client, admin_token):
+        """測試像公式或超長網址的文字原樣匯出，不被轉換或截掉"""
+        import openpyxl
+        long_url = "https://example.com/" + "a" * 2100
+        created = client.post('/api/parcels',
+            headers={'Authorization': f'Bearer {admin_token}'},
+            json={
+                "sender_id": "admin1",
+                "recipient_name": "原樣匯出",
+                "recipient_address": long_url,
+                "weight": 1.0,
+                "contents": "=1+1",
+            }
+        )
+        tracking_no = json.loads(created.data)['tracking_no']
+
+        response = client.get('/api/download',
+            headers={'Authorization': f'Bearer {admin_token}'}
+        )
+        assert response.status_code == 200
+        wb = openpyxl.load_workbook(io.BytesIO(response.data), read_only=True)
+        row = next(r for r in wb["包裹清單"].iter_rows(min_row=2, values_only=True) if r[0] == tracking_no)
+        assert row[3] == long_url
+        assert row[7] == "=1+1"
+        assert row[12]  # 建立時間沒有因為前面的欄位失敗而被略過
+        wb.close()
+    
     def test_download_as_staff(self, client, staff_token):
         """測試作業人員下載"""
         response = client.get('/api/download',